@@ -0,0 +1,60 @@
+"""
+Shared setup for the benchmark scripts. Import this before anything from the twsaucenao package.
+
+Benchmarks run from a throwaway working directory with their own config.ini and SQLite database, so they never touch
+a live installation. Twitter credential checks are answered locally, as no benchmark talks to the real Twitter API.
+"""
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+import tweepy
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, 'benchmarks', 'fixtures')
+
+BOT_USER = {'id': 1219954473080061953, 'id_str': '1219954473080061953', 'name': 'SauceBot',
+            'screen_name': 'SauceBot'}
+
+CONFIG = """
+[System]
+language: english
+log_level: ERROR
+display_patreon: false
+
+[Twitter]
+consumer_key: BENCHMARK
+consumer_secret: BENCHMARK
+access_token: BENCHMARK
+access_secret: BENCHMARK
+monitored_accounts:
+
+[SauceNao]
+api_key: BENCHMARK
+
+[TraceMoe]
+enabled: false
+
+[SQLite]
+filename: {database}
+"""
+
+
+def _offline_user(api, *args, **kwargs):
+    return tweepy.models.User.parse(api, BOT_USER)
+
+
+workdir = tempfile.mkdtemp(prefix='twsaucenao-bench-')
+atexit.register(shutil.rmtree, workdir, True)
+
+os.symlink(os.path.join(ROOT, 'lang'), os.path.join(workdir, 'lang'))
+with open(os.path.join(workdir, 'config.ini'), 'w') as fh:
+    fh.write(CONFIG.format(database=os.path.join(workdir, 'database.sqlite')))
+
+os.chdir(workdir)
+sys.path.insert(0, ROOT)
+
+tweepy.API.verify_credentials = _offline_user
+tweepy.API.me = _offline_user
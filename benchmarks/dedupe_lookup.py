@@ -0,0 +1,77 @@
+"""
+Benchmark MediaHash.find_similar lookups against a large perceptual hash index.
+
+Usage:
+    python benchmarks/dedupe_lookup.py [--rows 1000000] [--queries 1000] [--threshold 3]
+"""
+import argparse
+import random
+import statistics
+import time
+
+import _bootstrap  # noqa: F401
+
+from pony.orm import commit, db_session
+
+from twsaucenao import phash
+from twsaucenao.models.database import db, MediaHash
+
+
+@db_session
+def populate(hashes):
+    connection = db.get_connection()
+    now = int(time.time())
+    rows = ((i, 0, phash.to_signed(h), *phash.bands(h), now) for i, h in enumerate(hashes, 1))
+    connection.executemany(
+            f"INSERT INTO {MediaHash._table_} "
+            "(tweet_id, index_no, media_hash, band_0, band_1, band_2, band_3, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            rows
+    )
+    commit()
+
+
+def near_duplicate(media_hash, max_bits):
+    for bit in random.sample(range(phash.HASH_BITS), random.randint(0, max_bits)):
+        media_hash ^= 1 << bit
+    return media_hash
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--threshold', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1337)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    hashes = [random.getrandbits(phash.HASH_BITS) for _ in range(args.rows)]
+
+    started = time.perf_counter()
+    populate(hashes)
+    print(f"Indexed {args.rows:,} hashes in {time.perf_counter() - started:.1f}s")
+
+    # Half of our queries are reposts of indexed media, the other half are brand new images
+    queries = [(near_duplicate(random.choice(hashes), args.threshold), True) for _ in range(args.queries // 2)]
+    queries += [(random.getrandbits(phash.HASH_BITS), False) for _ in range(args.queries - len(queries))]
+    random.shuffle(queries)
+
+    timings, found, expected = [], 0, 0
+    for media_hash, is_duplicate in queries:
+        started = time.perf_counter()
+        match = MediaHash.find_similar(media_hash, args.threshold)
+        timings.append((time.perf_counter() - started) * 1000)
+        found += bool(match and is_duplicate)
+        expected += is_duplicate
+
+    timings.sort()
+    print(f"{len(timings):,} lookups with a threshold of {args.threshold} bits")
+    print(f"  mean {statistics.mean(timings):.3f} ms")
+    for percentile in (50, 95, 99):
+        print(f"  p{percentile}  {timings[int(len(timings) * percentile / 100) - 1]:.3f} ms")
+    print(f"  near-duplicates found: {found:,} / {expected:,}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,376 @@
+"""
+End-to-end throughput benchmark: drive TwitterSauce through a synthetic mention storm against local fake services.
+
+An aiohttp server stands in for every remote API the bot talks to:
+  - Twitter REST: statuses/mentions_timeline, user_timeline, show, lookup and update, plus chunked media/upload
+  - SauceNao: search.php, answering with Pixiv or (for --anime-rate of hits) anime results
+  - trace.moe: api/search and the natural video preview
+Each service has a configurable latency (jittered +/- 50%) and error rate. Mentions are posted to the fake mentions
+timeline at --rate per second, each replying to one of --media distinct media tweets, while the bot polls for them
+exactly as it does in production.
+
+Throughput and p50/p95/p99 latencies are reported for every stage, measured from the bot's side of each call.
+
+Usage:
+    python benchmarks/e2e.py [--mentions 500] [--rate 25] [--media 200] [--workers 4] [--interval 1]
+                             [--twitter-latency 0.15] [--twitter-errors 0.0] [--saucenao-latency 0.8]
+                             [--saucenao-errors 0.0] [--tracemoe-latency 0.5] [--tracemoe-errors 0.0]
+                             [--hit-rate 0.9] [--anime-rate 0.3]
+"""
+import argparse
+import asyncio
+import collections
+import copy
+import functools
+import json
+import os
+import random
+import time
+
+import _bootstrap
+
+import requests
+from aiohttp import web
+from pysaucenao import AnimeSource
+
+from twsaucenao.api import async_api
+from twsaucenao.config import config
+from twsaucenao.sauce import PooledSauceNao
+from twsaucenao.server import TwitterSauce
+from twsaucenao.session import close_session
+from twsaucenao.tracemoe import tracemoe
+from twsaucenao.twitter import snowflake_id, TweetManager
+
+ANILIST_ID = 21034
+PREVIEW_BYTES = os.urandom(256 * 1024)
+
+timings = collections.defaultdict(list)  # type: dict
+errors = collections.Counter()
+
+
+def load_fixture(name: str) -> dict:
+    with open(os.path.join(_bootstrap.FIXTURES, name), encoding='utf-8') as fh:
+        return json.load(fh)
+
+
+def timed(stage: str, func):
+    """
+    Wrap a coroutine function so every call is timed under the given stage
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            errors[stage] += 1
+            raise
+        finally:
+            timings[stage].append(time.perf_counter() - started)
+
+    return wrapper
+
+
+class Service:
+    def __init__(self, latency: float, error_rate: float):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+
+    async def respond(self) -> bool:
+        """
+        Simulate the service's response time
+        Returns:
+            bool: False if this request should fail
+        """
+        self.requests += 1
+        await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+        return random.random() >= self.error_rate
+
+
+class FakeServices:
+    def __init__(self, args):
+        """
+        Local stand-ins for the Twitter, SauceNao and trace.moe API's
+        """
+        self.args = args
+        self.twitter = Service(args.twitter_latency, args.twitter_errors)
+        self.saucenao = Service(args.saucenao_latency, args.saucenao_errors)
+        self.tracemoe = Service(args.tracemoe_latency, args.tracemoe_errors)
+
+        self.media_template = load_fixture('media_tweet.json')
+        self.mention_template = load_fixture('mention_tweet.json')
+        self.media_ids = [snowflake_id(time.time() - 86400) + i for i in range(args.media)]
+
+        self.mentions = []  # type: list
+        self.posted_at = {}  # type: dict
+        self.replied_at = {}  # type: dict
+        self._ids = iter(range(1, 1 << 62))
+
+        self.runner = None
+        self.base_url = None
+
+    # Service lifecycle
+    async def start(self) -> str:
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_get('/1.1/statuses/mentions_timeline.json', self.mentions_timeline)
+        app.router.add_get('/1.1/statuses/user_timeline.json', self.user_timeline)
+        app.router.add_get('/1.1/statuses/show.json', self.show)
+        app.router.add_route('*', '/1.1/statuses/lookup.json', self.lookup)
+        app.router.add_post('/1.1/statuses/update.json', self.update)
+        app.router.add_post('/1.1/media/upload.json', self.upload)
+        app.router.add_get('/search.php', self.search)
+        app.router.add_get('/tracemoe/api/search', self.tracemoe_search)
+        app.router.add_get('/tracemoe/media/video/{anilist_id}/{filename}', self.tracemoe_preview)
+
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+
+        port = self.runner.addresses[0][1]
+        self.base_url = f"http://127.0.0.1:{port}"
+        return self.base_url
+
+    async def stop(self) -> None:
+        await self.runner.cleanup()
+
+    def route(self) -> None:
+        """
+        Point every client the bot uses at our fake services
+        """
+        send = requests.Session.send
+        hosts = ('https://api.twitter.com', 'https://upload.twitter.com')
+        base_url = self.base_url
+
+        def _send(session, request, **kwargs):
+            for host in hosts:
+                if request.url.startswith(host):
+                    request.url = base_url + request.url[len(host):]
+            return send(session, request, **kwargs)
+
+        requests.Session.send = _send
+
+        PooledSauceNao.API_URL = f"{base_url}/search.php"
+        tracemoe.api_url = f"{base_url}/tracemoe/api/"
+        tracemoe.main_url = f"{base_url}/tracemoe/"
+        tracemoe.media_url = f"{base_url}/tracemoe/media/"
+
+        # AniList ID's are mapped through relations.yuna.moe, which pysaucenao calls directly
+        async def load_ids(source):
+            source._ids = {'anidb': source.data.get('anidb_aid'), 'anilist': ANILIST_ID}
+            return source._ids
+
+        AnimeSource.load_ids = load_ids
+
+    # The mention storm
+    async def storm(self, count: int, rate: float) -> None:
+        for i in range(count):
+            payload = copy.deepcopy(self.mention_template)
+            payload['id'] = snowflake_id(time.time()) + i
+            payload['id_str'] = str(payload['id'])
+            payload['full_text'] = '@SauceBot sauce?'
+            payload['in_reply_to_status_id'] = random.choice(self.media_ids)
+            payload['in_reply_to_status_id_str'] = str(payload['in_reply_to_status_id'])
+
+            self.mentions.append(payload)
+            self.posted_at[payload['id']] = time.perf_counter()
+            await asyncio.sleep(1 / rate)
+
+    # Twitter
+    @staticmethod
+    def twitter_error() -> web.Response:
+        return web.json_response({'errors': [{'code': 130, 'message': 'Over capacity'}]}, status=503)
+
+    def media_tweet(self, tweet_id: int) -> dict:
+        payload = copy.deepcopy(self.media_template)
+        payload['id'], payload['id_str'] = tweet_id, str(tweet_id)
+        payload['extended_entities']['media'][0]['media_url_https'] = f"https://pbs.twimg.com/media/{tweet_id}.jpg"
+        return payload
+
+    async def mentions_timeline(self, request: web.Request) -> web.Response:
+        if not await self.twitter.respond():
+            return self.twitter_error()
+
+        since_id = int(request.query.get('since_id', 0))
+        max_id = int(request.query.get('max_id', 1 << 63))
+        count = int(request.query.get('count', 20))
+        tweets = [t for t in reversed(self.mentions) if since_id < t['id'] <= max_id]
+        return web.json_response(tweets[:count])
+
+    async def user_timeline(self, request: web.Request) -> web.Response:
+        return web.json_response([]) if await self.twitter.respond() else self.twitter_error()
+
+    async def show(self, request: web.Request) -> web.Response:
+        if not await self.twitter.respond():
+            return self.twitter_error()
+
+        return web.json_response(self.media_tweet(int(request.query['id'])))
+
+    async def lookup(self, request: web.Request) -> web.Response:
+        if not await self.twitter.respond():
+            return self.twitter_error()
+
+        params = dict(request.query)
+        params.update(await request.post())
+        return web.json_response([self.media_tweet(int(i)) for i in str(params['id']).split(',')])
+
+    async def update(self, request: web.Request) -> web.Response:
+        if not await self.twitter.respond():
+            return self.twitter_error()
+
+        params = dict(request.query)
+        params.update(await request.post())
+        to = int(params.get('in_reply_to_status_id', 0))
+        self.replied_at.setdefault(to, time.perf_counter())
+
+        payload = copy.deepcopy(self.mention_template)
+        payload['id'] = next(self._ids)
+        payload['id_str'], payload['full_text'] = str(payload['id']), params.get('status', '')
+        payload['in_reply_to_status_id'] = to
+        return web.json_response(payload)
+
+    async def upload(self, request: web.Request) -> web.Response:
+        if not await self.twitter.respond():
+            return self.twitter_error()
+
+        params = dict(request.query)
+        params.update(await request.post())
+        if params.get('command') == 'APPEND':
+            return web.Response(status=204)
+
+        media_id = int(params.get('media_id') or next(self._ids))
+        return web.json_response({'media_id': media_id, 'media_id_string': str(media_id)})
+
+    # SauceNao
+    async def search(self, request: web.Request) -> web.Response:
+        if not await self.saucenao.respond():
+            return web.Response(status=503, text='Service Unavailable')
+
+        header = {'user_id': '0', 'account_type': '2', 'short_limit': '1000', 'long_limit': '100000',
+                  'short_remaining': 1000, 'long_remaining': 100000, 'status': 0, 'results_requested': 6,
+                  'search_depth': '128', 'minimum_similarity': 50.0, 'results_returned': 1}
+
+        results = []
+        if random.random() < self.args.hit_rate:
+            if random.random() < self.args.anime_rate:
+                results.append({
+                    'header': {'similarity': '94.12', 'thumbnail': 'https://img3.saucenao.com/anime.jpg',
+                               'index_id': 21, 'index_name': 'Index #21: Anime - anime.jpg', 'dupes': 0},
+                    'data': {'ext_urls': ['https://anidb.net/anime/14111'], 'source': 'Benchmark Anime',
+                             'anidb_aid': 14111, 'part': '5', 'year': '2019', 'est_time': '00:10:15 / 00:24:01'}
+                })
+            else:
+                results.append({
+                    'header': {'similarity': '92.51', 'thumbnail': 'https://img3.saucenao.com/pixiv.jpg',
+                               'index_id': 5, 'index_name': 'Index #5: Pixiv Images - pixiv.jpg', 'dupes': 0},
+                    'data': {'ext_urls': ['https://www.pixiv.net/member_illust.php?mode=medium&illust_id=12345'],
+                             'title': 'Benchmark', 'pixiv_id': 12345, 'member_name': 'Artist', 'member_id': 6789}
+                })
+
+        return web.json_response({'header': header, 'results': results})
+
+    # trace.moe
+    async def tracemoe_search(self, request: web.Request) -> web.Response:
+        if not await self.tracemoe.respond():
+            return web.Response(status=503, text='Service Unavailable')
+
+        return web.json_response({'docs': [{'anilist_id': ANILIST_ID, 'filename': 'episode5.mp4', 'episode': 5,
+                                            'at': 615.5, 'similarity': 0.95, 'tokenthumb': 'benchmark'}]})
+
+    async def tracemoe_preview(self, request: web.Request) -> web.Response:
+        if not await self.tracemoe.respond():
+            return web.Response(status=503, text='Service Unavailable')
+
+        return web.Response(body=PREVIEW_BYTES, content_type='video/mp4')
+
+
+def instrument(twitter) -> None:
+    """
+    Time every stage of the reply pipeline from the bot's side
+    """
+    async_api.page = timed('timeline fetch', async_api.page)
+    async_api.get_status = timed('get_status', async_api.get_status)
+    async_api.statuses_lookup = timed('statuses_lookup', async_api.statuses_lookup)
+    async_api.upload_video = timed('video upload', async_api.upload_video)
+    async_api.update_status = timed('update_status', async_api.update_status)
+
+    TweetManager.hydrate = timed('parent hydration', TweetManager.hydrate)
+    twitter.get_closest_media = timed('parent traversal', twitter.get_closest_media)
+    PooledSauceNao.from_url = timed('saucenao lookup', PooledSauceNao.from_url)
+    tracemoe.search = timed('trace.moe search', tracemoe.search)
+    tracemoe.video_preview_natural = timed('preview download', tracemoe.video_preview_natural)
+
+
+def percentile(values, pct: int) -> float:
+    return values[max(0, int(len(values) * pct / 100) - 1)] if values else 0.0
+
+
+async def run(args) -> None:
+    fakes = FakeServices(args)
+    await fakes.start()
+    fakes.route()
+
+    twitter = TwitterSauce()
+    instrument(twitter)
+
+    started = time.perf_counter()
+    storm = asyncio.ensure_future(fakes.storm(args.mentions, args.rate))
+
+    # Poll until the storm has passed and we've caught up with it
+    while True:
+        since_id = twitter.mention_cursor.since_id
+        await twitter.check_mentions()
+        if storm.done() and twitter.mention_cursor.since_id == since_id:
+            break
+        await asyncio.sleep(args.interval)
+
+    elapsed = time.perf_counter() - started
+    await twitter.queue.close()
+    await close_session()
+    await fakes.stop()
+
+    end_to_end = sorted(fakes.replied_at[i] - fakes.posted_at[i] for i in fakes.replied_at if i in fakes.posted_at)
+    timings['end-to-end'] = end_to_end
+
+    print(f"{args.mentions:,} mentions at {args.rate:g}/s across {args.media:,} media tweets, "
+          f"{args.workers} lookup workers")
+    print(f"  completed in {elapsed:.1f}s; {len(end_to_end):,} replies ({len(end_to_end) / elapsed:.2f}/s)")
+    print(f"  requests: twitter {fakes.twitter.requests:,}, saucenao {fakes.saucenao.requests:,}, "
+          f"trace.moe {fakes.tracemoe.requests:,}")
+    print()
+    print(f"  {'stage':<18} {'calls':>7} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for stage, values in timings.items():
+        values = sorted(values)
+        print(f"  {stage:<18} {len(values):>7,} {errors[stage]:>7,} {percentile(values, 50) * 1000:>9.1f} "
+              f"{percentile(values, 95) * 1000:>9.1f} {percentile(values, 99) * 1000:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mentions', type=int, default=500)
+    parser.add_argument('--rate', type=float, default=25.0, help='Mentions posted per second')
+    parser.add_argument('--media', type=int, default=200, help='Distinct media tweets mentions reply to')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--interval', type=float, default=1.0, help='Seconds between mention polls')
+    parser.add_argument('--twitter-latency', type=float, default=0.15)
+    parser.add_argument('--twitter-errors', type=float, default=0.0)
+    parser.add_argument('--saucenao-latency', type=float, default=0.8)
+    parser.add_argument('--saucenao-errors', type=float, default=0.0)
+    parser.add_argument('--tracemoe-latency', type=float, default=0.5)
+    parser.add_argument('--tracemoe-errors', type=float, default=0.0)
+    parser.add_argument('--hit-rate', type=float, default=0.9)
+    parser.add_argument('--anime-rate', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=1337)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    config.set('Twitter', 'lookup_workers', str(args.workers))
+    config.set('TraceMoe', 'enabled', 'true')
+    config.set('SauceNao', 'respond_to_failed', 'true')
+
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()
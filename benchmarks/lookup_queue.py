@@ -0,0 +1,67 @@
+"""
+Check that a backlog of jobs in one conversation doesn't hold up unrelated conversations in the LookupQueue.
+
+A burst of mentions under one popular post all share a conversation key, so they must be processed one at a time.
+They're submitted ahead of a handful of jobs for unrelated conversations, which should still finish after about one
+job's duration rather than waiting behind the burst. Exits with status 1 if they don't.
+
+Usage:
+    python benchmarks/lookup_queue.py [--workers 4] [--burst 8] [--unrelated 4] [--duration 0.1]
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+import _bootstrap  # noqa: F401
+
+from twsaucenao.pipeline import LookupQueue
+
+
+async def run(args) -> bool:
+    queue = LookupQueue(args.workers)
+    started = time.monotonic()
+    running = {}
+    finished = {}
+
+    async def job(key, job_no):
+        # Jobs sharing a key must never overlap
+        assert not running.get(key), f"Jobs for conversation {key} ran concurrently"
+        running[key] = True
+        await asyncio.sleep(args.duration)
+        running[key] = False
+        finished[(key, job_no)] = time.monotonic() - started
+        return job_no
+
+    burst = [queue.submit('popular', job, 'popular', i) for i in range(args.burst)]
+    unrelated = [queue.submit(f"other-{i}", job, f"other-{i}", 0) for i in range(args.unrelated)]
+
+    burst_order = await asyncio.gather(*burst)
+    await asyncio.gather(*unrelated)
+    await queue.close()
+
+    popular = [finished[('popular', i)] for i in range(args.burst)]
+    others = [finished[(f"other-{i}", 0)] for i in range(args.unrelated)]
+    print(f"  burst of {args.burst} in one conversation: finished in order {burst_order == list(range(args.burst))}, "
+          f"last at {max(popular):.2f}s")
+    print(f"  {args.unrelated} unrelated conversations: finished at {min(others):.2f}s - {max(others):.2f}s")
+
+    # Every unrelated job should get a worker straight away, or at worst once the first round of jobs is done
+    return burst_order == list(range(args.burst)) and max(others) < args.duration * 2.5
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--burst', type=int, default=8, help='Jobs submitted under one conversation key')
+    parser.add_argument('--unrelated', type=int, default=4, help='Jobs for other conversations, submitted after')
+    parser.add_argument('--duration', type=float, default=0.1, help='Seconds each job takes')
+    args = parser.parse_args()
+
+    if not asyncio.get_event_loop().run_until_complete(run(args)):
+        print("Unrelated conversations were held up by the backlog in another conversation")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
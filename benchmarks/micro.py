@@ -0,0 +1,224 @@
+"""
+Microbenchmarks for the pure-Python code paths that run on the event loop for every reply.
+
+Each case is timed with timeit over --repeat runs and compared against a baseline. A case is only flagged as a
+regression, and the script exits with status 1, when its median time is more than --threshold slower than the
+baseline median, by at least --min-delta microseconds, and even its fastest run is slower than the slowest baseline
+run. Flagged cases are measured again (--confirm times), and only fail the gate if every measurement regresses. That
+keeps scheduler noise and CPU frequency drift on the sub-microsecond cases from failing the gate.
+Timings are machine specific, so the baseline isn't committed: record one with --save on the machine you'll be
+comparing on (e.g. before making a change) and run again afterwards.
+
+Usage:
+    python benchmarks/micro.py [--threshold 0.25] [--min-delta 0.5] [--repeat 7] [--confirm 2] [--filter NAME]
+                               [--baseline FILE] [--save]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import timeit
+
+import _bootstrap
+
+import tweepy
+from pony.orm import db_session
+from pysaucenao.containers import SauceNaoResults
+
+from twsaucenao.api import api
+from twsaucenao.config import config
+from twsaucenao.lang import lang
+from twsaucenao.models.database import _parsed_tweets, TRIGGER_MENTION, TweetCache, TweetSauceCache
+from twsaucenao.server import TwitterSauce
+from twsaucenao.twitter import ReplyLine, TweetManager
+
+BASELINE = os.path.join(_bootstrap.ROOT, 'benchmarks', 'micro_baseline.json')
+
+
+def load_fixture(name: str) -> dict:
+    with open(os.path.join(_bootstrap.FIXTURES, name), encoding='utf-8') as fh:
+        return json.load(fh)
+
+
+def run_coroutine(coro):
+    """
+    Drive a coroutine that never actually suspends to completion, without the overhead of an event loop
+    """
+    try:
+        coro.send(None)
+    except StopIteration as result:
+        return result.value
+
+    raise RuntimeError('Coroutine suspended; it cannot be benchmarked synchronously')
+
+
+class Fixtures:
+    def __init__(self):
+        """
+        Realistic payloads for every case: a multi-image media tweet, a mention replying to it and the cached
+        SauceNao result of every container type we reply with
+        """
+        self.media_json = load_fixture('media_tweet.json')
+        self.mention_json = load_fixture('mention_tweet.json')
+        self.media = tweepy.models.Status.parse(api, self.media_json)
+        self.mention = tweepy.models.Status.parse(api, self.mention_json)
+
+        self.media_cache = TweetCache.set(self.media, True)
+        self.mention_cache = TweetCache.set(self.mention, False)
+
+        # One cached sauce lookup per container type, each stored against its own media index
+        response = load_fixture('saucenao_response.json')
+        self.sauce_caches = {}
+        for index_no, result in enumerate(response['results']):
+            results = SauceNaoResults(dict(response, results=[result]))
+            sauce_cache = TweetSauceCache.set(self.media_cache, results, index_no, TRIGGER_MENTION)
+            self.sauce_caches[type(results.results[0]).__name__] = sauce_cache
+
+        self.twitter = TwitterSauce()
+        self.reply_lines = [
+            ReplyLine(lang('Results', 'requested_found', {'index': 'Pixiv'}, user=self.mention.author) + "\n", 1),
+            ReplyLine(lang('Results', 'twitter', {'twitter': '@sakura_artworks'}), newlines=1),
+            ReplyLine(lang('Results', 'author', {'author': 'さくら'}), newlines=1),
+            ReplyLine(lang('Results', 'title', {'title': '春の訪れ'}), 10, newlines=1),
+            ReplyLine(lang('Results', 'material', {'material': 'Original'}), 5, newlines=1),
+            ReplyLine(lang('Results', 'character', {'character': 'Hatsune Miku'}), 4, newlines=1),
+            ReplyLine(lang('Accuracy', 'prefix', {'similarity': 93.87}) + " " + lang('Accuracy', 'high'), 2,
+                      newlines=1),
+            ReplyLine("https://www.pixiv.net/member_illust.php?mode=medium&illust_id=90123456", newlines=2),
+            ReplyLine("Support SauceBot!\nhttps://www.patreon.com/saucebot", 3, newlines=2),
+        ]
+
+
+def cases(fx: Fixtures) -> dict:
+    """
+    Returns:
+        dict: Case name => zero argument callable to time
+    """
+    posted = []
+
+    async def capture_post(msg, to=None, media_ids=None, sensitive=False):
+        posted.append(''.join(map(str, msg)) if isinstance(msg, list) else msg)
+
+    fx.twitter._post = capture_post
+
+    def tweet_parse():
+        _parsed_tweets.clear()
+        return fx.media_cache.tweet
+
+    def send_reply(sauce_class: str):
+        return lambda: run_coroutine(fx.twitter.send_reply(fx.mention_cache, fx.media_cache,
+                                                           fx.sauce_caches[sauce_class]))
+
+    def shorten_reply():
+        lines = list(fx.reply_lines)
+        try:
+            while True:
+                lines = fx.twitter._shorten_reply(lines)
+        except IndexError:
+            return lines
+
+    return {
+        'extract_media': lambda: TweetManager.extract_media(fx.media),
+        'tweet_parse': lambda: tweepy.models.Status.parse(api, fx.media_json),
+        'tweet_cache_cold': tweet_parse,
+        'tweet_cache_memoized': lambda: fx.media_cache.tweet,
+        'sauce_pixiv': lambda: fx.sauce_caches['PixivSource'].sauce,
+        'sauce_booru': lambda: fx.sauce_caches['BooruSource'].sauce,
+        'sauce_anime': lambda: fx.sauce_caches['AnimeSource'].sauce,
+        'lang': lambda: lang('Results', 'requested_found', {'index': 'Pixiv'}, user=fx.mention.author),
+        'lang_no_replacements': lambda: lang('Accuracy', 'exact'),
+        'send_reply_pixiv': send_reply('PixivSource'),
+        'send_reply_booru': send_reply('BooruSource'),
+        'reply_join': lambda: ''.join(map(str, fx.reply_lines)),
+        'shorten_reply': shorten_reply,
+    }
+
+
+def measure(func, repeat: int) -> dict:
+    """
+    Returns:
+        dict: The median, fastest and slowest time per call across every run, in seconds
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    runs = [t / number for t in timer.repeat(repeat, number)]
+    return {'median': statistics.median(runs), 'min': min(runs), 'max': max(runs)}
+
+
+def regressed(result: dict, baseline: dict, threshold: float, min_delta: float) -> bool:
+    """
+    Returns:
+        bool: True if a result is slower than its baseline by more than the noise between runs
+    """
+    delta = result['median'] - baseline['median']
+    return delta > baseline['median'] * threshold and delta > min_delta and result['min'] > baseline['max']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Flag cases more than this fraction slower than the baseline')
+    parser.add_argument('--min-delta', type=float, default=0.5,
+                        help='Ignore slowdowns smaller than this many microseconds per call')
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--confirm', type=int, default=2,
+                        help='Measure flagged cases this many more times before reporting a regression')
+    parser.add_argument('--filter', default='', help='Only run cases whose name contains this string')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save', action='store_true', help='Save these results as the new baseline')
+    args = parser.parse_args()
+
+    config.set('System', 'display_patreon', 'true')
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as fh:
+            baseline = json.load(fh)
+    elif not args.save:
+        print(f"No baseline at {args.baseline}; run with --save to record one on this machine")
+
+    with db_session:
+        fx = Fixtures()
+        results = {}
+        regressions = []
+
+        print(f"  {'case':<24} {'median':>12} {'baseline':>12} {'change':>9}")
+        for name, func in cases(fx).items():
+            if args.filter not in name:
+                continue
+
+            results[name] = measure(func, args.repeat)
+            is_regression = False
+            if name in baseline:
+                is_regression = regressed(results[name], baseline[name], args.threshold, args.min_delta / 1e6)
+                for _ in range(args.confirm if is_regression else 0):
+                    result = measure(func, args.repeat)
+                    results[name] = min(results[name], result, key=lambda r: r['median'])
+                    if not regressed(result, baseline[name], args.threshold, args.min_delta / 1e6):
+                        is_regression = False
+                        break
+
+            line = f"  {name:<24} {results[name]['median'] * 1e6:>10.2f}us"
+            if name in baseline:
+                change = (results[name]['median'] - baseline[name]['median']) / baseline[name]['median']
+                line += f" {baseline[name]['median'] * 1e6:>10.2f}us {change:>+8.1%}"
+                if is_regression:
+                    regressions.append(name)
+                    line += "  REGRESSION"
+
+            print(line)
+
+    if args.save:
+        with open(args.baseline, 'w', encoding='utf-8') as fh:
+            json.dump(dict(baseline, **results), fh, indent=2, sort_keys=True)
+            fh.write('\n')
+        print(f"Saved {len(results)} results to {args.baseline}")
+
+    if regressions:
+        print(f"{len(regressions)} case(s) regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+"""
+Replay recorded timeline traffic through TwitterSauce against stubbed Twitter and SauceNao clients.
+
+Recordings are written by the bot itself when [Twitter] record_timelines is set, starting a new timestamped file every
+hour. Pass every file you want to replay; they're played back in filename (i.e. chronological) order.
+Every recorded tweet is released at the time it was originally received (divided by --speed), and the bot polls for it
+exactly as it would in production. Parent tweets that weren't recorded are answered with a synthetic media tweet, so
+every lookup exercises the full reply path. SauceNao enforces the --short-limit / --long-limit quotas the same way the
+real API does.
+
+Usage:
+    python benchmarks/replay.py traffic-*.jsonl.gz [--speed 60] [--interval 1] [--twitter-latency 0.2]
+                                                   [--saucenao-latency 1.5] [--hit-rate 0.8]
+"""
+import argparse
+import asyncio
+import collections
+import copy
+import itertools
+import json
+import os
+import random
+import statistics
+import time
+
+import _bootstrap
+
+import tweepy
+
+from twsaucenao.api import api, async_api
+from twsaucenao.config import config
+from twsaucenao.ingest import ReplaySource
+from twsaucenao.sauce import PooledSauceNao
+from twsaucenao.server import TwitterSauce
+from twsaucenao.session import close_session
+
+
+def load_fixture(name: str) -> dict:
+    with open(os.path.join(_bootstrap.FIXTURES, name), encoding='utf-8') as fh:
+        return json.load(fh)
+
+
+class StubTwitter:
+    def __init__(self, source: ReplaySource, latency: float):
+        """
+        Answers the Twitter API requests made while processing tweets, without talking to Twitter
+        """
+        self.source = source
+        self.latency = latency
+        self.media_template = load_fixture('media_tweet.json')
+        self.reply_template = load_fixture('mention_tweet.json')
+        self._ids = itertools.count(1)
+
+        self.requests = collections.Counter()
+        self.reply_lag = []
+
+    def install(self) -> None:
+        for method in ('get_status', 'statuses_lookup', 'update_status', 'upload_video'):
+            setattr(async_api, method, getattr(self, method))
+
+    def _status(self, tweet_id: int):
+        if tweet_id in self.source.tweets:
+            return self.source.tweets[tweet_id]
+
+        payload = copy.deepcopy(self.media_template)
+        payload['id'], payload['id_str'] = tweet_id, str(tweet_id)
+        payload['extended_entities']['media'][0]['media_url_https'] = f"https://pbs.twimg.com/media/{tweet_id}.jpg"
+        return tweepy.models.Status.parse(api, payload)
+
+    async def get_status(self, tweet_id: int, **kwargs):
+        self.requests['get_status'] += 1
+        await asyncio.sleep(self.latency)
+        return self._status(tweet_id)
+
+    async def statuses_lookup(self, tweet_ids, **kwargs):
+        self.requests['statuses_lookup'] += 1
+        await asyncio.sleep(self.latency)
+        return [self._status(tweet_id) for tweet_id in tweet_ids]
+
+    async def update_status(self, status: str, **kwargs):
+        self.requests['update_status'] += 1
+        await asyncio.sleep(self.latency)
+
+        to = kwargs.get('in_reply_to_status_id')
+        if to in self.source.released_at:
+            self.reply_lag.append(time.time() - self.source.released_at[to])
+
+        payload = copy.deepcopy(self.reply_template)
+        payload['id'] = next(self._ids)
+        payload['id_str'], payload['full_text'], payload['in_reply_to_status_id'] = str(payload['id']), status, to
+        return tweepy.models.Status.parse(api, payload)
+
+    async def upload_video(self, media, media_type: str = 'video/mp4') -> dict:
+        self.requests['upload_video'] += 1
+        await asyncio.sleep(self.latency)
+        return {'media_id': next(self._ids)}
+
+
+class StubSauceNao:
+    def __init__(self, latency: float, hit_rate: float, short_limit: int, long_limit: int):
+        """
+        Answers SauceNao searches with a canned Pixiv result, enforcing the same request limits SauceNao does
+        """
+        self.latency = latency
+        self.hit_rate = hit_rate
+        self.short_limit = short_limit
+        self.long_limit = long_limit
+
+        self.requests = 0
+        self.rejected = 0
+        self._history = collections.deque()
+
+    def install(self) -> None:
+        stub = self
+
+        async def _fetch(client, session, url: str, params=None):
+            return await stub.search()
+
+        PooledSauceNao._fetch = PooledSauceNao._post = _fetch
+
+    def _header(self, short_remaining: int, long_remaining: int, message: str = '') -> dict:
+        return {'user_id': '0', 'account_type': '1', 'short_limit': str(self.short_limit),
+                'long_limit': str(self.long_limit), 'short_remaining': short_remaining,
+                'long_remaining': long_remaining, 'status': 0, 'message': message, 'results_requested': 6,
+                'search_depth': '128', 'minimum_similarity': 50.0, 'results_returned': 1}
+
+    async def search(self):
+        await asyncio.sleep(self.latency)
+
+        now = time.time()
+        while self._history and self._history[0] < now - 30:
+            self._history.popleft()
+
+        short_remaining = self.short_limit - len(self._history)
+        long_remaining = self.long_limit - self.requests
+        if short_remaining <= 0 or long_remaining <= 0:
+            self.rejected += 1
+            message = 'Search Rate Too High. You are limited to 4 searches every 30 seconds.' if short_remaining <= 0 \
+                else 'Daily Search Limit Exceeded.'
+            return 429, {'header': self._header(0, max(0, long_remaining), message=message)}
+
+        self.requests += 1
+        self._history.append(now)
+
+        results = []
+        if random.random() < self.hit_rate:
+            results.append({
+                'header': {'similarity': '92.51', 'thumbnail': 'https://img3.saucenao.com/stub.jpg', 'index_id': 5,
+                           'index_name': 'Index #5: Pixiv Images - 12345.jpg', 'dupes': 0},
+                'data': {'ext_urls': ['https://www.pixiv.net/member_illust.php?mode=medium&illust_id=12345'],
+                         'title': 'Replay', 'pixiv_id': 12345, 'member_name': 'Artist', 'member_id': 6789}
+            })
+
+        return 200, {'header': self._header(short_remaining - 1, long_remaining - 1), 'results': results}
+
+
+def percentile(values, pct: int) -> float:
+    return values[max(0, int(len(values) * pct / 100) - 1)] if values else 0.0
+
+
+async def replay(twitter, source: ReplaySource, interval: float) -> None:
+    while not source.finished:
+        await asyncio.gather(twitter.check_mentions(), twitter.check_self(), twitter.check_monitored())
+        await asyncio.sleep(max(0.01, min(interval, source.wait_time())))
+
+    await twitter.queue.close()
+    await close_session()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('recordings', nargs='+')
+    parser.add_argument('--speed', type=float, default=60.0)
+    parser.add_argument('--interval', type=float, default=1.0, help='Seconds between timeline polls')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--twitter-latency', type=float, default=0.2)
+    parser.add_argument('--saucenao-latency', type=float, default=1.5)
+    parser.add_argument('--hit-rate', type=float, default=0.8)
+    parser.add_argument('--short-limit', type=int, default=6)
+    parser.add_argument('--long-limit', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1337)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    source = ReplaySource(sorted(args.recordings), args.speed)
+    config.set('Twitter', 'monitored_accounts', ','.join(sorted(source.accounts())))
+    config.set('Twitter', 'lookup_workers', str(args.workers))
+
+    twitter_stub = StubTwitter(source, args.twitter_latency)
+    twitter_stub.install()
+    saucenao_stub = StubSauceNao(args.saucenao_latency, args.hit_rate, args.short_limit, args.long_limit)
+    saucenao_stub.install()
+
+    twitter = TwitterSauce(source)
+
+    started = time.time()
+    asyncio.get_event_loop().run_until_complete(replay(twitter, source, args.interval))
+    elapsed = time.time() - started
+
+    lag = sorted(twitter_stub.reply_lag)
+    print(f"Replayed {len(source.tweets):,} tweets at {args.speed:g}x in {elapsed:.1f}s")
+    print(f"  replies sent:       {len(lag):,} ({len(lag) / elapsed:.2f}/s)")
+    print(f"  saucenao requests:  {saucenao_stub.requests:,} ({saucenao_stub.rejected:,} rejected for quota)")
+    print(f"  twitter requests:   {dict(twitter_stub.requests)}")
+    if lag:
+        print(f"  reply lag:          mean {statistics.mean(lag):.2f}s, p50 {percentile(lag, 50):.2f}s, "
+              f"p95 {percentile(lag, 95):.2f}s, p99 {percentile(lag, 99):.2f}s")
+
+
+if __name__ == '__main__':
+    main()
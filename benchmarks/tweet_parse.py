@@ -0,0 +1,89 @@
+"""
+Microbenchmark for TweetCache.tweet parsing over a single mention reply.
+
+Replays the TweetCache.tweet reads one mention reply performs (bot reply check, parent traversal, index selection,
+the sauce lookup and send_reply) and counts how many times tweepy has to parse the cached JSON.
+
+Usage:
+    python benchmarks/tweet_parse.py [--replies 2000]
+"""
+import argparse
+import json
+import os
+import time
+
+import _bootstrap
+
+import tweepy
+
+from twsaucenao.api import api
+from twsaucenao.models.database import _parsed_tweets, TweetCache
+from twsaucenao.twitter import TweetManager
+
+
+def load_fixture(name: str):
+    with open(os.path.join(_bootstrap.FIXTURES, name), encoding='utf-8') as fh:
+        return tweepy.models.Status.parse(api, json.load(fh))
+
+
+def reply_reads(mention: TweetCache, media: TweetCache, read):
+    """
+    The TweetCache.tweet reads performed while replying to one mention, in call order
+    """
+    # TweetManager._is_bot_reply
+    read(media).author.id
+    read(media).author.id
+    read(media).full_text
+    # TweetManager.get_closest_media traversal
+    TweetManager.extract_media(read(media))
+    # TwitterSauce._process_mention
+    read(media).author.id
+    # TwitterSauce._determine_requested_index
+    TweetManager.extract_media(read(media))
+    # SauceManager._get_sauce
+    TweetManager.extract_media(read(media))
+    # TwitterSauce.send_reply
+    read(mention).author
+    read(media).author.screen_name
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--replies', type=int, default=2000)
+    args = parser.parse_args()
+
+    mention, media = load_fixture('mention_tweet.json'), load_fixture('media_tweet.json')
+    TweetCache.set(media, True)
+
+    parse_calls = 0
+    original_parse = tweepy.models.Status.parse.__func__
+
+    def counting_parse(cls, *a, **kw):
+        nonlocal parse_calls
+        parse_calls += 1
+        return original_parse(cls, *a, **kw)
+
+    tweepy.models.Status.parse = classmethod(counting_parse)
+
+    strategies = {
+        'parse on every read': lambda cache: tweepy.models.Status.parse(api, cache.data),
+        'memoized': lambda cache: cache.tweet,
+    }
+    for label, read in strategies.items():
+        parse_calls, elapsed = 0, 0.0
+        for _ in range(args.replies):
+            # The mention is cached by get_closest_media as it arrives, while the media tweet is loaded back from the
+            # database with nothing memoized yet
+            _parsed_tweets.clear()
+            mention_cache, media_cache = TweetCache.set(mention), TweetCache.fetch(media.id)
+
+            started = time.perf_counter()
+            reply_reads(mention_cache, media_cache, read)
+            elapsed += time.perf_counter() - started
+
+        print(f"{label:>20}: {parse_calls / args.replies:.1f} parses per reply, "
+              f"{elapsed / args.replies * 1_000_000:.1f} µs per reply")
+
+
+if __name__ == '__main__':
+    main()
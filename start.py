@@ -1,15 +1,24 @@
 import asyncio
+import contextlib
+import signal
 
 from twsaucenao.config import config
 from twsaucenao.log import log
-from twsaucenao.models.database import TweetCache, TweetSauceCache
+from twsaucenao.maintenance import archive_sauce, purge_processed_posts, purge_tweets
+from twsaucenao.metrics import METRICS_ENABLED, METRICS_HOST, METRICS_PORT, metrics
+from twsaucenao.models.database import TweetSauceCache
+from twsaucenao.models.migrations import migrate
 from twsaucenao.server import TwitterSauce
+from twsaucenao.session import close_session
 
 # Get our polling intervals
 mentioned_interval = float(config.get('Twitter', 'mentioned_interval', fallback=15.0))
 monitored_interval = float(config.get('Twitter', 'monitored_interval', fallback=60.0))
 search_interval = float(config.get('Twitter', 'search_interval', fallback=60.0))
 
+# Bring databases created by older releases up to date before we start
+migrate()
+
 twitter = TwitterSauce()
 
 
@@ -58,7 +67,7 @@ async def monitored() -> None:
         try:
             # Monitored accounts
             await twitter.check_monitored()
-            await asyncio.sleep(monitored_interval)
+            await asyncio.sleep(twitter.monitored_wait(monitored_interval))
         except Exception:
             log.exception("An unknown error occurred while checking monitored accounts")
             await asyncio.sleep(60.0)
@@ -74,13 +83,28 @@ async def cleanup() -> None:
     while True:
         try:
             # Cache purging
-            stale_count = TweetCache.purge()
-            print(f"\nPurging {stale_count:,} stale cache entries from the database")
+            stale_count = await purge_tweets()
+            print(f"\nPurged {stale_count:,} stale cache entries from the database")
+
+            await purge_processed_posts()
+
+            archived_count = await archive_sauce()
+            if archived_count:
+                print(f"Archived {archived_count:,} expired sauce queries")
 
             # Sauce analytics
             sauce_count = TweetSauceCache.sauce_count(900)
             print(f"We've processed {sauce_count:,} new sauce queries!")
 
+            cache_stats = twitter.sauce_manager.cache_stats()
+            print(f"Media cache: {cache_stats['memory_hits']:,} memory hits, {cache_stats['database_hits']:,} database "
+                  f"hits, {cache_stats['misses']:,} misses, {cache_stats['coalesced']:,} coalesced")
+
+            for key in twitter.sauce_manager.quota_stats():
+                print(f"SauceNao key {key['key_id']}: {key['requests']:,} requests, {key['limit_hits']:,} limit hits, "
+                      f"{key['short_remaining']}/{key['short_limit']} short and "
+                      f"{key['long_remaining']:,}/{key['long_limit']:,} daily requests remaining")
+
             await asyncio.sleep(900.0)
         except Exception:
             log.exception("An unknown error occurred while performing cleanup tasks")
@@ -103,9 +127,25 @@ async def main() -> None:
     tasks.append(monitored())
     tasks.append(cleanup())
 
-    await asyncio.gather(*tasks)
+    if METRICS_ENABLED:
+        await metrics.serve(METRICS_HOST, METRICS_PORT)
+
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        await metrics.close()
+        await close_session()
+        twitter.source.close()
 
 
 if __name__ == '__main__':
     loop = asyncio.get_event_loop()
-    loop.run_until_complete(main())
+    main_task = loop.create_task(main())
+
+    # Shut down cleanly when we're stopped, so timeline recordings and connections are closed properly
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        with contextlib.suppress(NotImplementedError):
+            loop.add_signal_handler(signum, main_task.cancel)
+
+    with contextlib.suppress(asyncio.CancelledError):
+        loop.run_until_complete(main_task)
@@ -1,8 +1,14 @@
+import asyncio
+import functools
 import logging
+import typing
+from concurrent.futures import ThreadPoolExecutor
 
 import tweepy
+from twython import Twython
 
 from twsaucenao.config import config
+from twsaucenao.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -32,6 +38,161 @@ def _twitter_api(key: str, secret: str, token: str, token_secret: str):
     return _api
 
 
+class AsyncTwitter:
+    def __init__(self, _api: tweepy.API, twython: typing.Optional[Twython] = None,
+                 executor: typing.Optional[ThreadPoolExecutor] = None):
+        """
+        Awaitable wrapper around the (blocking) tweepy and Twython clients.
+        Every request is executed on a managed thread pool, so a slow Twitter round trip never stalls the event loop.
+        Args:
+            _api (tweepy.api.API): The tweepy API instance to wrap
+            twython (typing.Optional[Twython]): Twython client used for chunked media uploads
+            executor (typing.Optional[ThreadPoolExecutor]): Thread pool to execute requests on
+        """
+        self.api = _api
+        self.twython = twython
+        self._executor = executor or ThreadPoolExecutor(max_workers=8, thread_name_prefix='twitter')
+
+    async def _call(self, func: typing.Callable, *args, **kwargs):
+        """
+        Execute a blocking API call on our thread pool
+        Args:
+            func (typing.Callable): The method to call
+            *args: Positional arguments to pass to the method
+            **kwargs: Keyword arguments to pass to the method
+
+        Returns:
+            Whatever the API call returns
+        """
+        loop = asyncio.get_event_loop()
+        try:
+            return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+        except tweepy.TweepError as error:
+            metrics.twitter_error(error.api_code)
+            raise
+
+    async def me(self):
+        """
+        Returns:
+            tweepy.models.User
+        """
+        return await self._call(self.api.me)
+
+    async def get_status(self, tweet_id: int, **kwargs):
+        """
+        Args:
+            tweet_id (int): The tweet ID to look up
+
+        Returns:
+            tweepy.models.Status
+        """
+        return await self._call(self.api.get_status, tweet_id, **kwargs)
+
+    async def statuses_lookup(self, tweet_ids: typing.List[int], **kwargs) -> list:
+        """
+        Args:
+            tweet_ids (typing.List[int]): Up to 100 tweet ID's to look up in a single request
+
+        Returns:
+            typing.List[tweepy.models.Status]: Every tweet that could be retrieved. Deleted, protected and otherwise
+            unavailable tweets are silently omitted.
+        """
+        return await self._call(self.api.statuses_lookup, tweet_ids, **kwargs)
+
+    @metrics.timed('update_status')
+    async def update_status(self, status: str, **kwargs):
+        """
+        Args:
+            status (str): The text of the status update
+
+        Returns:
+            tweepy.models.Status
+        """
+        return await self._call(self.api.update_status, status, **kwargs)
+
+    async def lists_all(self, **kwargs) -> list:
+        """
+        Returns:
+            typing.List[tweepy.models.List]: Every list the user owns or subscribes to
+        """
+        return await self._call(self.api.lists_all, **kwargs)
+
+    async def create_list(self, name: str, **kwargs):
+        """
+        Args:
+            name (str): The name of the list
+
+        Returns:
+            tweepy.models.List
+        """
+        return await self._call(self.api.create_list, name=name, **kwargs)
+
+    async def add_list_members(self, screen_names: typing.List[str], list_id: int):
+        """
+        Args:
+            screen_names (typing.List[str]): Up to 100 accounts to add to the list
+            list_id (int): The list ID
+
+        Returns:
+            tweepy.models.List
+        """
+        return await self._call(self.api.add_list_members, screen_name=screen_names, list_id=list_id)
+
+    async def remove_list_members(self, screen_names: typing.List[str], list_id: int):
+        """
+        Args:
+            screen_names (typing.List[str]): Up to 100 accounts to remove from the list
+            list_id (int): The list ID
+
+        Returns:
+            tweepy.models.List
+        """
+        return await self._call(self.api.remove_list_members, screen_name=screen_names, list_id=list_id)
+
+    @metrics.timed('timeline_fetch')
+    async def page(self, method: str, *args, **kwargs) -> list:
+        """
+        Retrieve a single page from a timeline method
+        Args:
+            method (str): Name of the tweepy API method to call (e.g. mentions_timeline)
+            *args: Positional arguments to pass to the method
+            **kwargs: Keyword arguments to pass to the method (since_id, max_id, count, ...)
+
+        Returns:
+            list
+        """
+        return await self._call(getattr(self.api, method), *args, **kwargs)
+
+    async def items(self, method: str, *args, limit: int = 0, **kwargs) -> list:
+        """
+        Page through a timeline method with a tweepy Cursor and return every item
+        Args:
+            method (str): Name of the tweepy API method to page through (e.g. mentions_timeline)
+            *args: Positional arguments to pass to the method
+            limit (int): Maximum number of items to retrieve. 0 for no limit.
+            **kwargs: Keyword arguments to pass to the method
+
+        Returns:
+            list
+        """
+        def _items():
+            return [*tweepy.Cursor(getattr(self.api, method), *args, **kwargs).items(limit)]
+
+        return await self._call(_items)
+
+    @metrics.timed('video_upload')
+    async def upload_video(self, media: typing.BinaryIO, media_type: str = 'video/mp4') -> dict:
+        """
+        Args:
+            media (typing.BinaryIO): The video to upload
+            media_type (str): The videos MIME type
+
+        Returns:
+            dict: Twitters media upload response
+        """
+        return await self._call(self.twython.upload_video, media=media, media_type=media_type)
+
+
 api = _twitter_api(config.get('Twitter', 'consumer_key'), config.get('Twitter', 'consumer_secret'),
                    config.get('Twitter', 'access_token'), config.get('Twitter', 'access_secret'))
 
@@ -44,3 +205,12 @@ if config.has_section('TwitterReadOnly'):
 else:
     readonly_api = None
 
+
+_executor = ThreadPoolExecutor(max_workers=int(config.get('Twitter', 'api_threads', fallback=8)),
+                               thread_name_prefix='twitter')
+twython = Twython(config.get('Twitter', 'consumer_key'), config.get('Twitter', 'consumer_secret'),
+                  config.get('Twitter', 'access_token'), config.get('Twitter', 'access_secret'))
+
+async_api = AsyncTwitter(api, twython, _executor)
+async_readonly_api = AsyncTwitter(readonly_api, executor=_executor) if readonly_api else None
+
@@ -0,0 +1,134 @@
+import time
+import typing
+from collections import OrderedDict
+
+
+class LRUCache:
+    def __init__(self, maxsize: int = 1024, expired: typing.Optional[typing.Callable[[typing.Any], bool]] = None):
+        """
+        A bounded, in-process least-recently-used cache that keeps track of its own hit and miss counts
+        Args:
+            maxsize (int): The maximum number of entries to hold before evicting the least recently used ones
+            expired (typing.Optional[typing.Callable[[typing.Any], bool]]): Returns True for cached values that are
+                no longer valid. Expired entries are evicted when they're looked up, and count as misses.
+        """
+        self.maxsize = max(1, int(maxsize))
+        self.expired = expired
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # type: typing.OrderedDict[typing.Hashable, typing.Any]
+
+    def get(self, key: typing.Hashable, default=None):
+        """
+        Retrieve an entry from the cache, marking it as recently used
+        Args:
+            key (typing.Hashable): The cache key
+            default: Value to return on a cache miss
+
+        Returns:
+            The cached value, or `default`
+        """
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        if self.expired and self.expired(value):
+            del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: typing.Hashable, value) -> None:
+        """
+        Add or replace an entry, evicting the least recently used entry if the cache is full
+        Args:
+            key (typing.Hashable): The cache key
+            value: The value to cache
+
+        Returns:
+            None
+        """
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: typing.Hashable, default=None):
+        """
+        Remove an entry from the cache
+        Args:
+            key (typing.Hashable): The cache key
+            default: Value to return if the key is not cached
+
+        Returns:
+            The removed value, or `default`
+        """
+        return self._data.pop(key, default)
+
+    def clear(self) -> None:
+        """
+        Remove every entry from the cache. Hit and miss counts are preserved.
+        Returns:
+            None
+        """
+        self._data.clear()
+
+    @property
+    def hit_ratio(self) -> float:
+        """
+        Returns:
+            float: The fraction of lookups that were cache hits
+        """
+        total = self.hits + self.misses
+        return (self.hits / total) if total else 0.0
+
+    def __contains__(self, key: typing.Hashable) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class ExpiringSet:
+    def __init__(self, maxsize: int = 100000, ttl: float = 604800):
+        """
+        A bounded set whose members expire `ttl` seconds after they're added.
+        Membership checks take constant time, and once `maxsize` members are held the oldest are evicted first.
+        Args:
+            maxsize (int): The maximum number of members to hold
+            ttl (float): How long members are remembered for, in seconds
+        """
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = ttl
+        self._data = OrderedDict()  # type: typing.OrderedDict[typing.Hashable, float]
+
+    def add(self, key: typing.Hashable, added_at: typing.Optional[float] = None) -> None:
+        """
+        Add a member to the set. Members must be added roughly oldest first.
+        Args:
+            key (typing.Hashable): The member to add
+            added_at (typing.Optional[float]): When the member was added. Defaults to now.
+
+        Returns:
+            None
+        """
+        self._data[key] = added_at or time.time()
+        self._data.move_to_end(key)
+        self._expire()
+
+    def _expire(self) -> None:
+        cutoff = time.time() - self.ttl
+        while self._data and (len(self._data) > self.maxsize or next(iter(self._data.values())) < cutoff):
+            self._data.popitem(last=False)
+
+    def __contains__(self, key: typing.Hashable) -> bool:
+        added_at = self._data.get(key)
+        return added_at is not None and added_at >= (time.time() - self.ttl)
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -0,0 +1,94 @@
+import logging
+import time
+from collections import OrderedDict
+
+from twsaucenao.config import config
+from twsaucenao.models.database import PollCursor
+from twsaucenao.twitter import snowflake_id
+
+# How far back to catch up on tweets posted while we were offline. 0 skips anything we missed.
+CATCH_UP_WINDOW = float(config.get('Twitter', 'catch_up_window', fallback=3600))
+
+
+class Checkpoint:
+    def __init__(self, name: str, catch_up: float = CATCH_UP_WINDOW):
+        """
+        A timeline polling cursor that is saved to the database as tweets are processed, so restarts resume where we
+        left off without any API calls.
+        Two positions are kept: `since_id` is the newest tweet we've queued, and is what we poll from. The saved
+        position only advances past a tweet once it, and every tweet queued before it, has finished processing.
+        Args:
+            name (str): The cursor name (e.g. mentions)
+            catch_up (float): Never resume from further back than `catch_up` seconds ago
+        """
+        self._log = logging.getLogger(__name__)
+        self.name = name
+
+        saved = PollCursor.fetch(name)
+        self.poll_rate = saved.poll_rate if saved else None
+
+        # There's no backlog to catch up on the very first time we run
+        floor = snowflake_id(time.time() - (catch_up if saved else 0))
+        self.since_id = max(saved.since_id if saved else 0, floor)
+        if saved and saved.since_id and saved.since_id < floor:
+            self._log.info(f"[{name}] Skipping tweets posted more than {catch_up:.0f} seconds ago")
+        elif saved:
+            self._log.info(f"[{name}] Resuming from tweet {self.since_id}")
+
+        self.committed = self.since_id
+        self._pending = OrderedDict()
+
+    def track(self, tweet_id: int) -> None:
+        """
+        Record that a tweet has been queued for processing. Tweets must be tracked oldest first.
+        Args:
+            tweet_id (int): The tweet ID
+
+        Returns:
+            None
+        """
+        self.since_id = max(self.since_id, tweet_id)
+        self._pending[tweet_id] = False
+
+    def done(self, tweet_id: int) -> None:
+        """
+        Record that a tweet has finished processing, saving our position if it has advanced
+        Args:
+            tweet_id (int): The tweet ID
+
+        Returns:
+            None
+        """
+        self._pending[tweet_id] = True
+
+        committed = None
+        while self._pending and next(iter(self._pending.values())):
+            committed, _ = self._pending.popitem(last=False)
+
+        if committed and committed > self.committed:
+            self.committed = committed
+            PollCursor.set(self.name, since_id=committed)
+
+    def skip(self, tweet_id: int) -> None:
+        """
+        Record a tweet we've chosen not to process
+        Args:
+            tweet_id (int): The tweet ID
+
+        Returns:
+            None
+        """
+        self.track(tweet_id)
+        self.done(tweet_id)
+
+    def save_rate(self, poll_rate: float) -> None:
+        """
+        Save the learned posting rate of the account this cursor polls
+        Args:
+            poll_rate (float): Posts per second
+
+        Returns:
+            None
+        """
+        self.poll_rate = poll_rate
+        PollCursor.set(self.name, poll_rate=poll_rate)
@@ -0,0 +1,283 @@
+import abc
+import collections
+import gzip
+import json
+import logging
+import os
+import time
+import typing
+
+import tweepy
+
+from twsaucenao.api import async_api
+from twsaucenao.config import config
+from twsaucenao.twitter import snowflake_id, snowflake_time
+
+# The largest page Twitter's timeline endpoints will return
+PAGE_SIZE = 200
+
+
+class TimelineSource(abc.ABC):
+    """
+    Where TwitterSauce gets new tweets from. Sources stream timelines oldest first, in batches, as tweets arrive.
+    """
+    @abc.abstractmethod
+    def timeline(self, method: str, *args, since_id: int, **kwargs) -> typing.AsyncIterator[list]:
+        """
+        Stream new tweets from a timeline, oldest first
+        Args:
+            method (str): Name of the tweepy API method for the timeline (e.g. mentions_timeline)
+            *args: Positional arguments to pass to the method
+            since_id (int): Only stream tweets newer than this ID
+            **kwargs: Keyword arguments to pass to the method
+
+        Yields:
+            typing.List[tweepy.models.Status]: The next batch of tweets, sorted oldest first
+        """
+
+    def close(self) -> None:
+        """
+        Release any resources held by the source
+        """
+
+
+class TwitterSource(TimelineSource):
+    def __init__(self):
+        """
+        Streams timelines from the Twitter API.
+        Twitter only pages timelines newest first, so when the backlog is larger than a page we instead walk forward
+        from `since_id` in time windows (using since_id / max_id bounds derived from tweet snowflakes), yielding each
+        window as soon as it's been fetched. Windows are resized as we go so each one holds about a page of tweets,
+        keeping memory bounded no matter how far behind we are.
+        """
+        self._log = logging.getLogger(__name__)
+
+    async def timeline(self, method: str, *args, since_id: int, **kwargs) -> typing.AsyncIterator[list]:
+        newest = await async_api.page(method, *args, since_id=since_id, count=PAGE_SIZE, **kwargs)
+        if not newest:
+            return
+
+        # The newest page is usually the whole backlog
+        older = await async_api.page(method, *args, since_id=since_id, max_id=min(t.id for t in newest) - 1,
+                                     count=PAGE_SIZE, **kwargs)
+        head = newest + older
+        if not older or not since_id:
+            yield sorted(head, key=lambda t: t.id)
+            return
+
+        # Otherwise, catch up on everything older than the pages we already have before processing them
+        stop = min(t.id for t in head) - 1
+        span = max(1.0, (snowflake_time(max(t.id for t in head)) - snowflake_time(stop)) * PAGE_SIZE / len(head))
+        self._log.info(f"[SYSTEM] Catching up on {method} from tweet {since_id} in {span:.0f} second windows")
+
+        low = since_id
+        while low < stop:
+            high = min(stop, max(low + 1, snowflake_id(snowflake_time(low) + span)))
+            tweets = await self._window(method, *args, since_id=low, max_id=high, **kwargs)
+            if tweets:
+                yield sorted(tweets, key=lambda t: t.id)
+
+            # Aim for about a page of tweets per window
+            if len(tweets) > PAGE_SIZE:
+                span = max(1.0, span / 2)
+            elif len(tweets) < PAGE_SIZE // 2:
+                span *= 2
+
+            low = high
+
+        yield sorted(head, key=lambda t: t.id)
+
+    @staticmethod
+    async def _window(method: str, *args, since_id: int, max_id: int, **kwargs) -> list:
+        """
+        Retrieve every tweet with since_id < ID <= max_id, paging backwards until Twitter returns an empty page
+        """
+        tweets = []
+        while True:
+            page = await async_api.page(method, *args, since_id=since_id, max_id=max_id, count=PAGE_SIZE, **kwargs)
+            if not page:
+                return tweets
+
+            tweets.extend(page)
+            max_id = min(t.id for t in page) - 1
+
+
+class RecordingSource(TimelineSource):
+    def __init__(self, source: TimelineSource, path: str, rotate_interval: int = 3600):
+        """
+        Passes another source through unchanged, writing every tweet it streams to gzip compressed JSONL files.
+        Each line holds the raw tweet payload along with the timeline it came from and when we received it, so the
+        files can be played back later with ReplaySource.
+        A new file is started on every run and every `rotate_interval` seconds, named after `path` with the time it
+        was started (e.g. traffic-20210301-120000.jsonl.gz). A gzip file is only readable to the end once it has been
+        closed, so rotating limits what an unclean shutdown can cost us to the file currently being written.
+        Args:
+            source (TimelineSource): The source to record
+            path (str): The base path of the files to write recorded tweets to
+            rotate_interval (int): Seconds to write to each file before starting a new one
+        """
+        self._log = logging.getLogger(__name__)
+        self.source = source
+        self.path = path
+        self.rotate_interval = rotate_interval
+
+        self._file = None  # type: typing.Optional[typing.TextIO]
+        self._rotate_at = 0.0
+
+    def _filename(self, started_at: float) -> str:
+        directory, filename = os.path.split(self.path)
+        stem, dot, extension = filename.partition('.')
+        return os.path.join(directory, f"{stem}-{time.strftime('%Y%m%d-%H%M%S', time.localtime(started_at))}"
+                                       f"{dot}{extension}")
+
+    def _rotate(self, now: float) -> None:
+        self.close()
+
+        path = self._filename(now)
+        self._file = gzip.open(path, 'at', encoding='utf-8')
+        self._rotate_at = now + self.rotate_interval
+        self._log.info(f"[SYSTEM] Recording timelines to {path}")
+
+    async def timeline(self, method: str, *args, since_id: int, **kwargs) -> typing.AsyncIterator[list]:
+        async for tweets in self.source.timeline(method, *args, since_id=since_id, **kwargs):
+            recorded_at = time.time()
+            if recorded_at >= self._rotate_at:
+                self._rotate(recorded_at)
+
+            for tweet in tweets:
+                self._file.write(json.dumps({'recorded_at': recorded_at, 'method': method, 'args': args,
+                                             'tweet': tweet._json}) + '\n')
+            self._file.flush()
+
+            yield tweets
+
+    def close(self) -> None:
+        if self._file:
+            self._file.close()
+            self._file = None
+
+        self.source.close()
+
+
+class ReplaySource(TimelineSource):
+    def __init__(self, paths: typing.Sequence[str], speed: float = 1.0):
+        """
+        Plays back files written by RecordingSource, in order. Tweets are released in the order, and with the timing,
+        they were originally received in, optionally sped up.
+        Every recorded tweet is delivered exactly once; since_id is ignored, as recorded tweets will always be older
+        than the cursors of the instance replaying them.
+        A file that was never closed properly (i.e. the bot was killed while recording) is played back up to the
+        point it was cut off at.
+        Args:
+            paths (typing.Sequence[str]): The recordings to play back
+            speed (float): Playback speed. 1 replays in real time, 60 replays an hour of traffic every minute.
+        """
+        self._log = logging.getLogger(__name__)
+        self.paths = list(paths)
+        self.speed = speed
+
+        self._files = iter(self.paths)
+        self._file = None  # type: typing.Optional[typing.TextIO]
+        self._next = None  # type: typing.Optional[dict]
+        self._pending = collections.defaultdict(list)  # type: typing.DefaultDict[tuple, list]
+
+        # Replay time is measured from the first recorded tweet, starting when the first timeline is requested
+        self._origin = None  # type: typing.Optional[float]
+        self._started = None  # type: typing.Optional[float]
+
+        # Every tweet released so far, and when
+        self.tweets = {}  # type: typing.Dict[int, tweepy.models.Status]
+        self.released_at = {}  # type: typing.Dict[int, float]
+
+    @property
+    def finished(self) -> bool:
+        """
+        Returns:
+            bool: True once every recorded tweet has been delivered
+        """
+        return self._started is not None and self._next is None and not any(self._pending.values())
+
+    def wait_time(self) -> float:
+        """
+        Returns:
+            float: Seconds until the next recorded tweet is released
+        """
+        if self._next is None or self._started is None:
+            return 0.0
+
+        return max(0.0, (self._next['recorded_at'] - self._origin) / self.speed - (time.time() - self._started))
+
+    def _read(self) -> typing.Optional[dict]:
+        while True:
+            if self._file is None:
+                path = next(self._files, None)
+                if path is None:
+                    return None
+                self._file = gzip.open(path, 'rt', encoding='utf-8')
+
+            try:
+                line = self._file.readline()
+                if line.endswith('\n'):
+                    return json.loads(line)
+            except EOFError:
+                self._log.warning(f"[SYSTEM] Recording {self._file.name} was cut off; skipping to the next file")
+
+            self._file.close()
+            self._file = None
+
+    def _release(self) -> None:
+        """
+        Queue every recorded tweet that is due by now
+        """
+        if self._started is None:
+            self._next = self._read()
+            self._origin = self._next['recorded_at'] if self._next else 0.0
+            self._started = time.time()
+
+        now = time.time()
+        replay_time = self._origin + (now - self._started) * self.speed
+        while self._next and self._next['recorded_at'] <= replay_time:
+            tweet = tweepy.models.Status.parse(async_api.api, self._next['tweet'])
+            self._pending[(self._next['method'], *self._next['args'])].append(tweet)
+            self.tweets[tweet.id] = tweet
+            self.released_at[tweet.id] = now
+            self._next = self._read()
+
+    async def timeline(self, method: str, *args, since_id: int, **kwargs) -> typing.AsyncIterator[list]:
+        self._release()
+
+        tweets = sorted(self._pending.pop((method, *args), []), key=lambda t: t.id)
+        for i in range(0, len(tweets), PAGE_SIZE):
+            yield tweets[i:i + PAGE_SIZE]
+
+    def accounts(self) -> typing.Set[str]:
+        """
+        Scan the recording for the monitored accounts it contains
+        Returns:
+            typing.Set[str]
+        """
+        accounts = set()
+        for path in self.paths:
+            with gzip.open(path, 'rt', encoding='utf-8') as fh:
+                try:
+                    for line in fh:
+                        entry = json.loads(line) if line.endswith('\n') else {}
+                        if entry.get('method') == 'user_timeline' and entry['args']:
+                            accounts.add(entry['args'][0])
+                except EOFError:
+                    pass
+
+        return accounts
+
+
+def default_source() -> TimelineSource:
+    """
+    Returns:
+        TimelineSource: The Twitter API, recorded to disk if record_timelines is configured
+    """
+    source = TwitterSource()
+    path = config.get('Twitter', 'record_timelines', fallback='')
+    if not path:
+        return source
+
+    return RecordingSource(source, path, int(config.get('Twitter', 'record_rotate_interval', fallback=3600)))
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import time
+import typing
+
+from twsaucenao.config import config
+from twsaucenao.models.database import MediaHash, MediaSauceCache, ProcessedPost, ResolvedMedia, TweetCache, \
+    TweetSauceCache
+
+_log = logging.getLogger(__name__)
+
+# Maintenance work is split into small transactions so the write lock is only ever held briefly. Batches that take
+# longer than MAX_LOCK_HOLD are halved until they fit, and we yield to the event loop between each one.
+BATCH_SIZE = int(config.get('System', 'maintenance_batch_size', fallback=500))
+MIN_BATCH_SIZE = 10
+MAX_LOCK_HOLD = float(config.get('System', 'maintenance_max_lock_ms', fallback=100.0)) / 1000
+BATCH_PAUSE = 0.05
+PROGRESS_INTERVAL = 10
+
+# Sauce lookups older than this are moved to the archive. Reposts can only be matched against lookups that are still
+# in the cache, so this also bounds how far back duplicate detection reaches.
+SAUCE_RETENTION = int(float(config.get('System', 'sauce_retention_days', fallback=30)) * 86400)
+
+# Media URL pointers are never used once the lookup they point at is more than a day old
+MEDIA_POINTER_RETENTION = 86400
+
+# How long to remember which monitored posts we've processed
+PROCESSED_POSTS_TTL = int(config.get('Twitter', 'processed_posts_ttl', fallback=604800))
+
+
+class BatchReport(typing.NamedTuple):
+    rows: int
+    batches: int
+    elapsed: float
+    longest_hold: float
+
+
+async def run_batched(name: str, batch: typing.Callable[[int], int], batch_size: int = BATCH_SIZE) -> BatchReport:
+    """
+    Repeatedly run a batch of maintenance work until there is nothing left to do.
+    Each call to `batch` should perform one bounded unit of work in its own transaction and return the number of
+    rows it affected. We stop as soon as a batch comes back short.
+    Args:
+        name (str): A description of the work being performed (for logging)
+        batch (typing.Callable[[int], int]): Performs a batch of up to N rows and returns the number of rows affected
+        batch_size (int): The initial (and maximum) number of rows per batch
+
+    Returns:
+        BatchReport
+    """
+    batch_size = max(MIN_BATCH_SIZE, batch_size)
+    size = batch_size
+    rows, batches, longest_hold = 0, 0, 0.0
+    started = time.monotonic()
+
+    while True:
+        batch_started = time.monotonic()
+        affected = batch(size)
+        hold = time.monotonic() - batch_started
+
+        rows += affected
+        batches += 1
+        longest_hold = max(longest_hold, hold)
+
+        if affected < size:
+            break
+
+        # Keep each transaction inside our lock budget
+        if hold > MAX_LOCK_HOLD and size > MIN_BATCH_SIZE:
+            size = max(MIN_BATCH_SIZE, size // 2)
+            _log.debug(f"[SYSTEM] {name}: batch took {hold * 1000:.0f}ms, reducing batch size to {size}")
+        elif hold < MAX_LOCK_HOLD / 4 and size < batch_size:
+            size = min(batch_size, size * 2)
+
+        if not batches % PROGRESS_INTERVAL:
+            _log.info(f"[SYSTEM] {name}: {rows:,} rows processed so far")
+        await asyncio.sleep(BATCH_PAUSE)
+
+    report = BatchReport(rows, batches, time.monotonic() - started, longest_hold)
+    if rows:
+        _log.info(f"[SYSTEM] {name}: {report.rows:,} rows in {report.batches:,} batches over {report.elapsed:.2f}s "
+                  f"(longest lock held {report.longest_hold * 1000:.0f}ms)")
+
+    return report
+
+
+async def purge_tweets(cutoff: int = 86400) -> int:
+    """
+    Purge stale entries from the tweet cache, along with the reply chains resolved through them
+    Args:
+        cutoff (int): Purge cache entries older than `cutoff` seconds. (Default is 1-day)
+
+    Returns:
+        int: The number of cache entries purged
+    """
+    cutoff_ts = int(time.time()) - cutoff
+    report = await run_batched('Purging stale tweet cache entries', lambda n: TweetCache.purge(cutoff_ts, n))
+    await run_batched('Purging stale resolved reply chains', lambda n: ResolvedMedia.purge(cutoff_ts, n))
+    return report.rows
+
+
+async def archive_sauce(retention: int = SAUCE_RETENTION) -> int:
+    """
+    Archive expired sauce lookups and purge the media pointers and hashes that referenced them
+    Args:
+        retention (int): Archive lookups older than `retention` seconds
+
+    Returns:
+        int: The number of sauce lookups archived
+    """
+    now = int(time.time())
+    cutoff_ts = now - retention
+
+    report = await run_batched('Archiving expired sauce lookups', lambda n: TweetSauceCache.archive(cutoff_ts, n))
+    await run_batched('Purging stale media hashes', lambda n: MediaHash.purge(cutoff_ts, n))
+    await run_batched('Purging stale media pointers',
+                      lambda n: MediaSauceCache.purge(now - min(retention, MEDIA_POINTER_RETENTION), n))
+
+    return report.rows
+
+
+async def purge_processed_posts(ttl: int = PROCESSED_POSTS_TTL) -> int:
+    """
+    Forget monitored posts we processed more than `ttl` seconds ago
+    Args:
+        ttl (int): How long processed posts are remembered for, in seconds
+
+    Returns:
+        int: The number of entries purged
+    """
+    cutoff_ts = int(time.time()) - ttl
+    report = await run_batched('Purging expired processed posts', lambda n: ProcessedPost.purge(cutoff_ts, n))
+    return report.rows
@@ -0,0 +1,258 @@
+import bisect
+import contextlib
+import functools
+import logging
+import time
+import typing
+
+from aiohttp import web
+
+from twsaucenao.config import config
+
+# Stage latency buckets, in seconds. These cover everything from cached tweet lookups to slow video uploads.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelSet = typing.Tuple[typing.Tuple[str, str], ...]
+Samples = typing.Iterable[typing.Tuple[typing.Dict[str, typing.Any], float]]
+
+
+def _label_set(labels: typing.Dict[str, typing.Any]) -> LabelSet:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: LabelSet) -> str:
+    if not labels:
+        return ''
+
+    escaped = (v.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, description: str):
+        """
+        A monotonically increasing count, broken down by labels
+        """
+        self.name = name
+        self.description = description
+        self.values = {}  # type: typing.Dict[LabelSet, float]
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_set(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def total(self, **labels) -> float:
+        """
+        Returns:
+            float: The sum of every series matching the given labels
+        """
+        wanted = set(_label_set(labels))
+        return sum(v for k, v in self.values.items() if wanted <= set(k))
+
+    def render(self) -> typing.List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_format_labels(k)} {_format_value(v)}" for k, v in sorted(self.values.items())]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, description: str, buckets: typing.Sequence[float] = LATENCY_BUCKETS):
+        """
+        A distribution of observed values (e.g. latencies), broken down by labels
+        """
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}  # type: typing.Dict[LabelSet, typing.List]
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_set(labels)
+        series = self.series.get(key)
+        if series is None:
+            # Per-bucket counts (with a final overflow bucket), sum and count
+            series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """
+        Observe how long the wrapped block takes to run
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> typing.List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', _format_value(bound)),))} "
+                             f"{cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+
+        return lines
+
+
+class Collector:
+    def __init__(self, name: str, description: str, kind: str, collect: typing.Callable[[], Samples]):
+        """
+        A metric whose samples are read from elsewhere in the application when we're scraped
+        """
+        self.name = name
+        self.description = description
+        self.kind = kind
+        self.collect = collect
+
+    def render(self) -> typing.List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{self.name}{_format_labels(_label_set(labels))} {_format_value(value)}"
+                  for labels, value in self.collect()]
+        return lines
+
+
+class Metrics:
+    def __init__(self):
+        """
+        Operational metrics, exposed in the Prometheus text format through an optional embedded HTTP endpoint
+        """
+        self._log = logging.getLogger(__name__)
+        self._runner = None  # type: typing.Optional[web.AppRunner]
+
+        self.stage_duration = Histogram('twsaucenao_stage_duration_seconds',
+                                        'Time spent in each stage of processing a tweet')
+        self.cache_requests = Counter('twsaucenao_cache_requests_total', 'Cache lookups, by cache and result')
+        self.twitter_errors = Counter('twsaucenao_twitter_errors_total', 'Twitter API errors, by API error code')
+        self.collectors = [
+            Collector('twsaucenao_cache_hit_ratio', 'Fraction of cache lookups that were hits', 'gauge',
+                      self._hit_ratios)
+        ]  # type: typing.List[Collector]
+
+    def stage(self, stage: str):
+        """
+        Time a stage of tweet processing
+        Args:
+            stage (str): The stage name (e.g. saucenao_lookup)
+
+        Returns:
+            A context manager
+        """
+        return self.stage_duration.time(stage=stage)
+
+    def timed(self, stage: str):
+        """
+        Decorator that times every call to a coroutine function as a stage of tweet processing
+        Args:
+            stage (str): The stage name (e.g. update_status)
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with self.stage(stage):
+                    return await func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def cache(self, cache: str, hit: bool, count: int = 1) -> None:
+        """
+        Record cache lookups
+        Args:
+            cache (str): The cache name (e.g. tweet)
+            hit (bool): True for cache hits, False for misses
+            count (int): The number of lookups
+
+        Returns:
+            None
+        """
+        if count:
+            self.cache_requests.inc(count, cache=cache, result='hit' if hit else 'miss')
+
+    def twitter_error(self, api_code: typing.Optional[int]) -> None:
+        self.twitter_errors.inc(api_code=api_code if api_code is not None else 'none')
+
+    def collect(self, name: str, description: str, collect: typing.Callable[[], Samples],
+                kind: str = 'gauge') -> None:
+        """
+        Register a metric that is read when we're scraped
+        Args:
+            name (str): The metric name
+            description (str): The metric description
+            collect (typing.Callable[[], Samples]): Returns (labels, value) pairs for every series
+            kind (str): The Prometheus metric type (gauge or counter)
+
+        Returns:
+            None
+        """
+        self.collectors = [c for c in self.collectors if c.name != name]
+        self.collectors.append(Collector(name, description, kind, collect))
+
+    def _hit_ratios(self) -> Samples:
+        caches = sorted({dict(k)['cache'] for k in self.cache_requests.values})
+        for cache in caches:
+            total = self.cache_requests.total(cache=cache)
+            if total:
+                yield {'cache': cache}, self.cache_requests.total(cache=cache, result='hit') / total
+
+    def render(self) -> str:
+        """
+        Returns:
+            str: Every metric, in the Prometheus text exposition format
+        """
+        lines = []
+        for metric in [self.stage_duration, self.cache_requests, self.twitter_errors, *self.collectors]:
+            try:
+                lines += metric.render()
+            except Exception:
+                self._log.exception(f"[SYSTEM] Unable to collect metric {metric.name}")
+
+        return '\n'.join(lines) + '\n'
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.render(), content_type='text/plain', charset='utf-8',
+                            headers={'X-Content-Type-Options': 'nosniff'})
+
+    async def serve(self, host: str, port: int) -> None:
+        """
+        Start serving metrics over HTTP at /metrics
+        Args:
+            host (str): The address to listen on
+            port (int): The port to listen on
+
+        Returns:
+            None
+        """
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        self._log.info(f"[SYSTEM] Serving metrics on http://{host}:{port}/metrics")
+
+    async def close(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+metrics = Metrics()
+
+METRICS_ENABLED = config.getboolean('Metrics', 'enabled', fallback=False)
+METRICS_HOST = config.get('Metrics', 'host', fallback='127.0.0.1')
+METRICS_PORT = int(config.get('Metrics', 'port', fallback=9464))
@@ -3,11 +3,14 @@ import typing
 
 import pysaucenao
 import tweepy
-from pony.orm import commit, count, Database, db_session, delete, Json, Optional, PrimaryKey, Required
+from pony.orm import commit, composite_key, Database, db_session, desc, Json, Optional, PrimaryKey, \
+    Required, select
 from pysaucenao import GenericSource
 from pysaucenao.containers import SauceNaoResults
 
+from twsaucenao import phash
 from twsaucenao.api import api
+from twsaucenao.cache import LRUCache
 from twsaucenao.config import config
 from twsaucenao.log import log
 
@@ -17,13 +20,16 @@ if config.has_section('MySQL'):
     db.bind(provider='mysql', host=config.get('MySQL', 'hostname'), user=config.get('MySQL', 'username'),
             passwd=config.get('MySQL', 'password'), db=config.get('MySQL', 'database'), charset='utf8mb4')
 else:
-    db.bind(provider='sqlite', filename='database.sqlite', create_db=True)
+    db.bind(provider='sqlite', filename=config.get('SQLite', 'filename', fallback='database.sqlite'), create_db=True)
 
 
 TRIGGER_MENTION = 'mentioned'
 TRIGGER_MONITORED = 'monitored'
 TRIGGER_SELF = 'self'
 
+# Parsed tweepy Status objects, keyed by tweet ID, so each cached tweet is only parsed once
+_parsed_tweets = LRUCache(int(config.get('System', 'parsed_tweet_cache_size', fallback=1024)))
+
 
 # noinspection PyMethodParameters
 class TweetCache(db.Entity):
@@ -50,6 +56,24 @@ class TweetCache(db.Entity):
         return tweet
 
     # noinspection PyUnresolvedReferences
+    # noinspection PyTypeChecker
+    @staticmethod
+    @db_session
+    def cached_ids(tweet_ids: typing.Iterable[int]) -> typing.Set[int]:
+        """
+        Check which of the given tweets are already cached, without loading them
+        Args:
+            tweet_ids (typing.Iterable[int]): Tweet ID's to check
+
+        Returns:
+            typing.Set[int]: The ID's that are cached
+        """
+        tweet_ids = list(tweet_ids)
+        if not tweet_ids:
+            return set()
+
+        return set(select(c.tweet_id for c in TweetCache if c.tweet_id in tweet_ids))
+
     @staticmethod
     @db_session
     def set(tweet: tweepy.models.Status, has_media: bool = False, blocked: bool = False) -> 'TweetCache':
@@ -68,37 +92,116 @@ class TweetCache(db.Entity):
                 has_media=has_media,
                 created_at=int(time.time())
         )
+
+        # We already have the parsed tweet, so there's no need to parse it again later
+        _parsed_tweets.set(tweet.id, tweet)
         return cache
 
     # noinspection PyTypeChecker
     @staticmethod
     @db_session
-    def purge(cutoff=86400):
+    def purge(cutoff_ts: int, limit: int) -> int:
         """
-        Purge old entries from the tweet cache
+        Purge a batch of the oldest cache entries created at or before `cutoff_ts`.
+        Only primary keys are read, so the cached tweet payloads are never loaded just to be deleted.
         Args:
-            cutoff (int): Purge cache entries older than `cutoff` seconds. (Default is 1-day)
+            cutoff_ts (int): Purge cache entries created at or before this timestamp
+            limit (int): The maximum number of entries to purge in this batch
 
         Returns:
-            int: The number of cache entries that have been purged (for logging)
+            int: The number of cache entries purged
         """
-        cutoff_ts = int(time.time()) - cutoff
-        stale_count = count(c for c in TweetCache if c.created_at <= cutoff_ts)
+        tweet_ids = select(c.tweet_id for c in TweetCache if c.created_at <= cutoff_ts)\
+            .order_by(lambda: c.created_at).limit(limit)[:]
 
         # No need to perform a delete query if there's nothing to delete
-        if stale_count:
-            delete(c for c in TweetCache if c.created_at <= cutoff_ts)
+        if tweet_ids:
+            TweetCache.select(lambda c: c.tweet_id in tweet_ids).delete(bulk=True)
+            for tweet_id in tweet_ids:
+                _parsed_tweets.pop(tweet_id)
 
-        return stale_count
+        return len(tweet_ids)
 
     @property
     def tweet(self):
         """
-        Loads a cached tweet back into a stateful object
+        Loads a cached tweet back into a stateful object.
+        The parsed object is memoized per tweet, and replaced whenever the cache entry is overwritten.
         Returns:
             tweepy.models.Status
         """
-        return tweepy.models.Status.parse(api, self.data)
+        tweet = _parsed_tweets.get(self.tweet_id)
+        if tweet is None:
+            tweet = tweepy.models.Status.parse(api, self.data)
+            _parsed_tweets.set(self.tweet_id, tweet)
+
+        return tweet
+
+
+# noinspection PyMethodParameters
+class ResolvedMedia(db.Entity):
+    reply_id        = PrimaryKey(int, size=64)
+    media_tweet_id  = Required(int, size=64)
+    created_at      = Required(int, size=64, index=True)
+
+    @staticmethod
+    @db_session
+    def fetch(reply_id: int, cutoff: int = 86400) -> typing.Optional[int]:
+        """
+        Look up the media tweet a reply chain has already been resolved to
+        Args:
+            reply_id (int): The tweet ID of any reply in the chain
+            cutoff (int): Only retrieve entries up to `cutoff` seconds old. (Default is 1-day)
+
+        Returns:
+            typing.Optional[int]: The media tweet ID
+        """
+        resolved = ResolvedMedia.get(reply_id=reply_id)
+        if not resolved or resolved.created_at < (int(time.time()) - cutoff):
+            return None
+
+        log.debug(f'[SYSTEM] Reply {reply_id} already resolved to media tweet {resolved.media_tweet_id}')
+        return resolved.media_tweet_id
+
+    @staticmethod
+    @db_session
+    def set(reply_ids: typing.Iterable[int], media_tweet_id: int) -> None:
+        """
+        Map every reply in a chain to the media tweet it resolved to
+        Args:
+            reply_ids (typing.Iterable[int]): Tweet ID's of the replies that were traversed
+            media_tweet_id (int): The media tweet they resolved to
+
+        Returns:
+            None
+        """
+        now = int(time.time())
+        for reply_id in set(reply_ids):
+            resolved = ResolvedMedia.get(reply_id=reply_id)
+            if resolved:
+                resolved.media_tweet_id, resolved.created_at = media_tweet_id, now
+            else:
+                ResolvedMedia(reply_id=reply_id, media_tweet_id=media_tweet_id, created_at=now)
+
+    # noinspection PyTypeChecker
+    @staticmethod
+    @db_session
+    def purge(cutoff_ts: int, limit: int) -> int:
+        """
+        Purge a batch of entries created at or before `cutoff_ts`
+        Args:
+            cutoff_ts (int): Purge entries created at or before this timestamp
+            limit (int): The maximum number of entries to purge in this batch
+
+        Returns:
+            int: The number of entries purged
+        """
+        reply_ids = select(r.reply_id for r in ResolvedMedia if r.created_at <= cutoff_ts)\
+            .order_by(lambda: r.created_at).limit(limit)[:]
+        if reply_ids:
+            ResolvedMedia.select(lambda r: r.reply_id in reply_ids).delete(bulk=True)
+
+        return len(reply_ids)
 
 
 class TweetSauceCache(db.Entity):
@@ -111,6 +214,7 @@ class TweetSauceCache(db.Entity):
     media_id        = Optional(int, size=64)
     trigger         = Optional(str, 50)
     created_at      = Required(int, size=64, index=True)
+    composite_key(tweet_id, index_no)
 
     @staticmethod
     @db_session
@@ -171,6 +275,7 @@ class TweetSauceCache(db.Entity):
                     media_id=media_id or 0,
                     created_at=int(time.time())
             )
+            SauceStats.record(_cache)
             return _cache
 
         if not sauce_results:
@@ -197,31 +302,85 @@ class TweetSauceCache(db.Entity):
                 media_id=media_id or 0,
                 created_at=int(time.time())
         )
+        SauceStats.record(cache)
         return cache
 
-    # noinspection PyTypeChecker
     @staticmethod
     @db_session
+    def clone(source: 'TweetSauceCache', tweet: TweetCache, index_no: int = 0, trigger: str = TRIGGER_MENTION,
+              media_id: typing.Optional[int] = None) -> 'TweetSauceCache':
+        """
+        Cache a copy of an existing sauce lookup for another tweet (e.g. a repost of the same artwork)
+        Args:
+            source (TweetSauceCache): The existing sauce lookup to copy
+            tweet (TweetCache): Cached Tweet entry
+            index_no (int): The media indice for tweets with multiple media uploads
+            trigger (str): The event that triggered the sauce lookup (purely for analytics)
+            media_id (Optional[int]): Video preview media ID to carry over. Uploaded media ID's expire, so this is
+                omitted by default.
+
+        Returns:
+            TweetSauceCache
+        """
+        cache = TweetSauceCache.get(tweet_id=tweet.tweet_id, index_no=index_no)
+        if cache:
+            log.info(f'[SYSTEM] Overwriting sauce cache entry for tweet {tweet.tweet_id}')
+            cache.delete()
+            commit()
+
+        log.info(f'[SYSTEM] Re-using the sauce lookup for tweet {source.tweet_id} on tweet {tweet.tweet_id}')
+        cache = TweetSauceCache(
+                tweet_id=tweet.tweet_id,
+                index_no=index_no,
+                sauce_header=source.sauce_header,
+                sauce_data=source.sauce_data,
+                sauce_class=source.sauce_class,
+                sauce_index=source.sauce_index,
+                trigger=trigger,
+                media_id=media_id or 0,
+                created_at=int(time.time())
+        )
+        SauceStats.record(cache)
+        return cache
+
+    @staticmethod
     def sauce_count(cutoff: typing.Optional[int] = None, found_only: bool = True) -> int:
         """
         Return a count of how many sauce lookups we've performed
         Args:
             cutoff (typing.Optional[int]): An optional cutoff. When defined, only count results logged in the last
-                `cutoff` seconds.
+                `cutoff` seconds (rounded out to the nearest SauceStats bucket).
             found_only (bool): Only count sauce queries that actually returned results.
 
         Returns:
             int
         """
-        now = int(time.time())
-        cutoff_ts = 0 if not cutoff else (now - cutoff)
+        return SauceStats.tally(cutoff, found_only)
 
-        if found_only:
-            sauce_count = count(s for s in TweetSauceCache if s.sauce_class and s.created_at >= cutoff_ts)
-        else:
-            sauce_count = count(s for s in TweetSauceCache if s.created_at >= cutoff_ts)
+    # noinspection PyTypeChecker
+    @staticmethod
+    @db_session
+    def archive(cutoff_ts: int, limit: int) -> int:
+        """
+        Move a batch of expired sauce lookups into the archive, keeping only their summary fields
+        Args:
+            cutoff_ts (int): Archive entries created at or before this timestamp
+            limit (int): The maximum number of entries to archive in this batch
 
-        return sauce_count
+        Returns:
+            int: The number of entries archived
+        """
+        expired = select(s for s in TweetSauceCache if s.created_at <= cutoff_ts)\
+            .order_by(TweetSauceCache.created_at).limit(limit)[:]
+        if not expired:
+            return 0
+
+        for sauce in expired:
+            TweetSauceArchive.from_cache(sauce)
+
+        ids = [sauce.id for sauce in expired]
+        TweetSauceCache.select(lambda s: s.id in ids).delete(bulk=True)
+        return len(ids)
 
     @property
     def sauce(self) -> typing.Optional[GenericSource]:
@@ -238,6 +397,299 @@ class TweetSauceCache(db.Entity):
         return sauce
 
 
+class MediaSauceCache(db.Entity):
+    media_url       = PrimaryKey(str, 255)
+    tweet_id        = Required(int, size=64)
+    index_no        = Required(int, size=8)
+    created_at      = Required(int, size=64, index=True)
+
+    @staticmethod
+    @db_session
+    def fetch(media_url: str, cutoff: int = 86400) -> typing.Optional[TweetSauceCache]:
+        """
+        Attempt to load a cached saucenao lookup for a media upload, regardless of which tweet it was found through
+        Args:
+            media_url (str): The canonical media URL
+            cutoff (int): Only retrieve cache entries up to `cutoff` seconds old. (Default is 1-day)
+
+        Returns:
+            typing.Optional[TweetSauceCache]
+        """
+        entry = MediaSauceCache.get(media_url=media_url)
+        if not entry:
+            return None
+
+        log.debug(f'[SYSTEM] Media cache hit for {media_url} via tweet {entry.tweet_id}')
+        return TweetSauceCache.fetch(entry.tweet_id, entry.index_no, cutoff)
+
+    @staticmethod
+    @db_session
+    def set(media_url: str, sauce_cache: TweetSauceCache) -> 'MediaSauceCache':
+        """
+        Point a media upload at the sauce lookup performed for it
+        Args:
+            media_url (str): The canonical media URL
+            sauce_cache (TweetSauceCache): The cached lookup
+
+        Returns:
+            MediaSauceCache
+        """
+        entry = MediaSauceCache.get(media_url=media_url)
+        if entry:
+            entry.delete()
+            commit()
+
+        return MediaSauceCache(
+                media_url=media_url,
+                tweet_id=sauce_cache.tweet_id,
+                index_no=sauce_cache.index_no,
+                created_at=int(time.time())
+        )
+
+    # noinspection PyTypeChecker
+    @staticmethod
+    @db_session
+    def purge(cutoff_ts: int, limit: int) -> int:
+        """
+        Purge a batch of media pointers created at or before `cutoff_ts`
+        Args:
+            cutoff_ts (int): Purge entries created at or before this timestamp
+            limit (int): The maximum number of entries to purge in this batch
+
+        Returns:
+            int: The number of entries purged
+        """
+        media_urls = select(m.media_url for m in MediaSauceCache if m.created_at <= cutoff_ts)\
+            .order_by(lambda: m.created_at).limit(limit)[:]
+        if media_urls:
+            MediaSauceCache.select(lambda m: m.media_url in media_urls).delete(bulk=True)
+
+        return len(media_urls)
+
+
+# noinspection PyMethodParameters
+class SauceStats(db.Entity):
+    bucket          = Required(int, size=64)
+    trigger         = Optional(str, 50)
+    sauce_index     = Optional(str, 255)
+    found           = Required(bool)
+    lookups         = Required(int, size=64)
+    composite_key(bucket, trigger, sauce_index, found)
+
+    # Lookups are counted in fixed time buckets, plus a running all-time total so lifetime counts never need a range scan
+    BUCKET_SIZE = 300
+    ALL_TIME = 0
+
+    @staticmethod
+    def record(sauce: TweetSauceCache, lookups: int = 1) -> None:
+        """
+        Count a sauce lookup towards its time bucket and the all-time totals. Must be called within a db_session.
+        Args:
+            sauce (TweetSauceCache): The sauce lookup that was just cached
+            lookups (int): The number of lookups to count
+
+        Returns:
+            None
+        """
+        found = bool(sauce.sauce_class)
+        sauce_index = sauce.sauce_index if found else ''
+        for bucket in (sauce.created_at - sauce.created_at % SauceStats.BUCKET_SIZE, SauceStats.ALL_TIME):
+            stats = SauceStats.get(bucket=bucket, trigger=sauce.trigger, sauce_index=sauce_index, found=found)
+            if stats:
+                stats.lookups += lookups
+            else:
+                SauceStats(bucket=bucket, trigger=sauce.trigger, sauce_index=sauce_index, found=found, lookups=lookups)
+
+    @staticmethod
+    def _buckets(cutoff: typing.Optional[int]):
+        if not cutoff:
+            return select(s for s in SauceStats if s.bucket == SauceStats.ALL_TIME)
+
+        cutoff_ts = int(time.time()) - cutoff
+        start = max(cutoff_ts - cutoff_ts % SauceStats.BUCKET_SIZE, SauceStats.ALL_TIME + 1)
+        return select(s for s in SauceStats if s.bucket >= start)
+
+    # noinspection PyTypeChecker
+    @staticmethod
+    @db_session
+    def tally(cutoff: typing.Optional[int] = None, found_only: bool = True,
+              trigger: typing.Optional[str] = None) -> int:
+        """
+        Count the sauce lookups we've performed
+        Args:
+            cutoff (typing.Optional[int]): When defined, only count lookups from the last `cutoff` seconds, rounded out
+                to the start of the oldest bucket.
+            found_only (bool): Only count sauce queries that actually returned results.
+            trigger (typing.Optional[str]): Only count lookups with this trigger
+
+        Returns:
+            int
+        """
+        stats = SauceStats._buckets(cutoff)
+        if found_only:
+            stats = stats.filter(lambda s: s.found)
+        if trigger:
+            stats = stats.filter(lambda s: s.trigger == trigger)
+
+        return sum(s.lookups for s in stats)
+
+    # noinspection PyTypeChecker
+    @staticmethod
+    @db_session
+    def breakdown(cutoff: typing.Optional[int] = None) -> typing.Dict[typing.Tuple[str, str, bool], int]:
+        """
+        Count the sauce lookups we've performed, grouped by trigger, index and whether sauce was found
+        Args:
+            cutoff (typing.Optional[int]): When defined, only count lookups from the last `cutoff` seconds, rounded out
+                to the start of the oldest bucket.
+
+        Returns:
+            typing.Dict[typing.Tuple[str, str, bool], int]: Lookup counts keyed by (trigger, sauce_index, found)
+        """
+        totals = {}
+        for s in SauceStats._buckets(cutoff):
+            key = (s.trigger, s.sauce_index, s.found)
+            totals[key] = totals.get(key, 0) + s.lookups
+
+        return totals
+
+
+class TweetSauceArchive(db.Entity):
+    tweet_id        = Required(int, size=64)
+    index_no        = Required(int, size=8)
+    sauce_class     = Optional(str, 255)
+    sauce_index     = Optional(str, 255)
+    similarity      = Optional(float)
+    trigger         = Optional(str, 50)
+    found           = Required(bool)
+    created_at      = Required(int, size=64, index=True)
+
+    @staticmethod
+    def from_cache(sauce: TweetSauceCache) -> 'TweetSauceArchive':
+        """
+        Create a compact archive entry from an expired sauce lookup. Must be called within a db_session.
+        Args:
+            sauce (TweetSauceCache): The sauce lookup being archived
+
+        Returns:
+            TweetSauceArchive
+        """
+        try:
+            similarity = float(sauce.sauce_header['similarity']) if sauce.sauce_header else None
+        except (KeyError, TypeError, ValueError):
+            similarity = None
+
+        return TweetSauceArchive(
+                tweet_id=sauce.tweet_id,
+                index_no=sauce.index_no,
+                sauce_class=sauce.sauce_class,
+                sauce_index=sauce.sauce_index,
+                similarity=similarity,
+                trigger=sauce.trigger,
+                found=bool(sauce.sauce_class),
+                created_at=sauce.created_at
+        )
+
+
+# noinspection PyMethodParameters
+class MediaHash(db.Entity):
+    tweet_id        = Required(int, size=64)
+    index_no        = Required(int, size=8)
+    media_hash      = Required(int, size=64)
+    band_0          = Required(int, size=32, index=True)
+    band_1          = Required(int, size=32, index=True)
+    band_2          = Required(int, size=32, index=True)
+    band_3          = Required(int, size=32, index=True)
+    created_at      = Required(int, size=64, index=True)
+    composite_key(tweet_id, index_no)
+
+    # Upper bound on how many band matches we're willing to compare per lookup
+    MAX_CANDIDATES = 500
+
+    @staticmethod
+    @db_session
+    def set(tweet_id: int, index_no: int, media_hash: int) -> 'MediaHash':
+        """
+        Index the perceptual hash of a media item we've looked up
+        Args:
+            tweet_id (int): Tweet ID the media belongs to
+            index_no (int): The media indice for tweets with multiple media uploads
+            media_hash (int): The unsigned 64-bit perceptual hash of the media
+
+        Returns:
+            MediaHash
+        """
+        existing = MediaHash.get(tweet_id=tweet_id, index_no=index_no)
+        if existing:
+            existing.delete()
+            commit()
+
+        band_0, band_1, band_2, band_3 = phash.bands(media_hash)
+        return MediaHash(
+                tweet_id=tweet_id,
+                index_no=index_no,
+                media_hash=phash.to_signed(media_hash),
+                band_0=band_0,
+                band_1=band_1,
+                band_2=band_2,
+                band_3=band_3,
+                created_at=int(time.time())
+        )
+
+    # noinspection PyTypeChecker
+    @staticmethod
+    @db_session
+    def find_similar(media_hash: int, threshold: int = 3) -> typing.Optional['MediaHash']:
+        """
+        Find the closest indexed media item within `threshold` bits of the provided hash.
+        Only entries sharing at least one hash band are compared, and at most MAX_CANDIDATES of them, those sharing the
+        most bands first. A match within `threshold` bits shares at least phash.HASH_BANDS - `threshold` bands, so near
+        duplicates are compared ahead of unrelated media that happens to share a crowded band. Matches are still
+        best-effort: in a crowded band, a match sharing only one band may be cut off.
+        Args:
+            media_hash (int): The unsigned 64-bit perceptual hash to search for
+            threshold (int): The maximum Hamming distance to consider a match
+
+        Returns:
+            typing.Optional[MediaHash]
+        """
+        band_0, band_1, band_2, band_3 = phash.bands(media_hash)
+        candidates = select(h for h in MediaHash
+                            if h.band_0 == band_0 or h.band_1 == band_1 or h.band_2 == band_2 or h.band_3 == band_3)\
+            .order_by("lambda h: desc((1 if h.band_0 == band_0 else 0) + (1 if h.band_1 == band_1 else 0) "
+                      "+ (1 if h.band_2 == band_2 else 0) + (1 if h.band_3 == band_3 else 0))")
+
+        best, best_distance = None, threshold + 1
+        for candidate in candidates.limit(MediaHash.MAX_CANDIDATES):
+            distance = phash.hamming(media_hash, phash.to_unsigned(candidate.media_hash))
+            if distance < best_distance:
+                best, best_distance = candidate, distance
+
+        if best:
+            log.debug(f'[SYSTEM] Media hash match found on tweet {best.tweet_id} (distance {best_distance})')
+        return best
+
+    # noinspection PyTypeChecker
+    @staticmethod
+    @db_session
+    def purge(cutoff_ts: int, limit: int) -> int:
+        """
+        Purge a batch of media hashes created at or before `cutoff_ts`
+        Args:
+            cutoff_ts (int): Purge entries created at or before this timestamp
+            limit (int): The maximum number of entries to purge in this batch
+
+        Returns:
+            int: The number of entries purged
+        """
+        ids = select(h.id for h in MediaHash if h.created_at <= cutoff_ts)\
+            .order_by(lambda: h.created_at).limit(limit)[:]
+        if ids:
+            MediaHash.select(lambda h: h.id in ids).delete(bulk=True)
+
+        return len(ids)
+
+
 class TwitterBlocklist(db.Entity):
     account_id      = PrimaryKey(int, size=64)
     username        = Required(str, 255)
@@ -271,4 +723,170 @@ class TwitterBlocklist(db.Entity):
         )
 
 
+class SauceQuota(db.Entity):
+    key_id          = PrimaryKey(str, 64)
+    short_limit     = Required(int)
+    short_remaining = Required(float)
+    long_limit      = Required(int)
+    long_remaining  = Required(float)
+    updated_at      = Required(float)
+
+    @staticmethod
+    @db_session
+    def fetch(key_id: str) -> typing.Optional['SauceQuota']:
+        """
+        Load the last known quota for a SauceNao API key
+        Args:
+            key_id (str): The API key identifier
+
+        Returns:
+            typing.Optional[SauceQuota]
+        """
+        return SauceQuota.get(key_id=key_id)
+
+    @staticmethod
+    @db_session
+    def set(key_id: str, short_limit: int, short_remaining: float, long_limit: int, long_remaining: float,
+            updated_at: float) -> 'SauceQuota':
+        """
+        Save the current quota for a SauceNao API key
+        Args:
+            key_id (str): The API key identifier
+            short_limit (int): Requests allowed per 30 seconds
+            short_remaining (float): Requests remaining in the short window
+            long_limit (int): Requests allowed per 24 hours
+            long_remaining (float): Requests remaining in the long window
+            updated_at (float): When the remaining counts were calculated
+
+        Returns:
+            SauceQuota
+        """
+        quota = SauceQuota.get(key_id=key_id)
+        if not quota:
+            return SauceQuota(
+                    key_id=key_id,
+                    short_limit=short_limit,
+                    short_remaining=short_remaining,
+                    long_limit=long_limit,
+                    long_remaining=long_remaining,
+                    updated_at=updated_at
+            )
+
+        quota.short_limit, quota.short_remaining = short_limit, short_remaining
+        quota.long_limit, quota.long_remaining = long_limit, long_remaining
+        quota.updated_at = updated_at
+
+        return quota
+
+
+class PollCursor(db.Entity):
+    name            = PrimaryKey(str, 255)
+    since_id        = Required(int, size=64)
+    poll_rate       = Optional(float)
+    updated_at      = Required(int, size=64)
+
+    @staticmethod
+    @db_session
+    def fetch(name: str) -> typing.Optional['PollCursor']:
+        """
+        Load a saved timeline polling cursor
+        Args:
+            name (str): The cursor name (e.g. mentions)
+
+        Returns:
+            typing.Optional[PollCursor]
+        """
+        return PollCursor.get(name=name)
+
+    @staticmethod
+    @db_session
+    def set(name: str, since_id: typing.Optional[int] = None,
+            poll_rate: typing.Optional[float] = None) -> 'PollCursor':
+        """
+        Save a timeline polling cursor
+        Args:
+            name (str): The cursor name (e.g. mentions)
+            since_id (typing.Optional[int]): Every tweet up to and including this ID has been processed
+            poll_rate (typing.Optional[float]): The learned posting rate of a monitored account, in posts per second
+
+        Returns:
+            PollCursor
+        """
+        cursor = PollCursor.get(name=name)
+        if not cursor:
+            return PollCursor(name=name, since_id=since_id or 0, poll_rate=poll_rate, updated_at=int(time.time()))
+
+        if since_id is not None:
+            cursor.since_id = since_id
+        if poll_rate is not None:
+            cursor.poll_rate = poll_rate
+        cursor.updated_at = int(time.time())
+
+        return cursor
+
+
+# noinspection PyMethodParameters
+class ProcessedPost(db.Entity):
+    tweet_id        = PrimaryKey(int, size=64)
+    created_at      = Required(int, size=64, index=True)
+
+    @staticmethod
+    @db_session
+    def add(tweet_id: int) -> 'ProcessedPost':
+        """
+        Record that we've processed a post from a monitored account
+        Args:
+            tweet_id (int): The tweet ID
+
+        Returns:
+            ProcessedPost
+        """
+        return ProcessedPost.get(tweet_id=tweet_id) or ProcessedPost(tweet_id=tweet_id, created_at=int(time.time()))
+
+    # noinspection PyTypeChecker
+    @staticmethod
+    @db_session
+    def recent(cutoff: int, limit: int) -> typing.List[typing.Tuple[int, int]]:
+        """
+        Load the most recently processed posts, oldest first
+        Args:
+            cutoff (int): Only load posts processed in the last `cutoff` seconds
+            limit (int): The maximum number of posts to load
+
+        Returns:
+            typing.List[typing.Tuple[int, int]]: (tweet_id, created_at) pairs
+        """
+        cutoff_ts = int(time.time()) - cutoff
+        posts = select((p.tweet_id, p.created_at) for p in ProcessedPost if p.created_at >= cutoff_ts)\
+            .order_by(lambda: desc(p.created_at)).limit(limit)[:]
+
+        return list(reversed(posts))
+
+    # noinspection PyTypeChecker
+    @staticmethod
+    @db_session
+    def purge(cutoff_ts: int, limit: int) -> int:
+        """
+        Purge a batch of entries created at or before `cutoff_ts`
+        Args:
+            cutoff_ts (int): Purge entries created at or before this timestamp
+            limit (int): The maximum number of entries to purge in this batch
+
+        Returns:
+            int: The number of entries purged
+        """
+        tweet_ids = select(p.tweet_id for p in ProcessedPost if p.created_at <= cutoff_ts)\
+            .order_by(lambda: p.created_at).limit(limit)[:]
+        if tweet_ids:
+            ProcessedPost.select(lambda p: p.tweet_id in tweet_ids).delete(bulk=True)
+
+        return len(tweet_ids)
+
+
+class SchemaMigration(db.Entity):
+    version         = PrimaryKey(int)
+    name            = Required(str, 255)
+    applied_at      = Required(int, size=64)
+
+
 db.generate_mapping(create_tables=True)
@@ -0,0 +1,215 @@
+"""
+Versioned schema migrations for databases created by older releases.
+
+Pony creates any missing tables on startup, but never alters existing ones. Schema changes to existing tables are
+applied here instead, in order, exactly once per database. Fresh installs already get the current schema from the
+entity definitions, so every migration must be safe to run against a database that is already up to date.
+
+Usage:
+    python -m twsaucenao.models.migrations [status|migrate]
+"""
+import logging
+import sys
+import time
+import typing
+
+from pony.orm import commit, db_session, IntegrityError, select
+
+from twsaucenao.models.database import db, SauceStats, SchemaMigration, TweetSauceArchive, TweetSauceCache
+
+log = logging.getLogger(__name__)
+
+# Duplicate rows are cleared out in batches of this many groups, each in its own transaction
+DEDUPE_BATCH_SIZE = 500
+
+# Rows duplicated while a unique index is being built make it fail; dedupe and retry this many times
+UNIQUE_INDEX_ATTEMPTS = 3
+
+
+class Migration(typing.NamedTuple):
+    version: int
+    name: str
+    apply: typing.Callable[[], None]
+
+
+def _is_mysql() -> bool:
+    return db.provider.dialect == 'MySQL'
+
+
+def _index_exists(table: str, columns: typing.Sequence[str], unique: bool = False) -> bool:
+    """
+    Check whether an index (or if `unique` is set, a unique index) already covers exactly the given columns (in order)
+    """
+    if _is_mysql():
+        non_unique = 0 if unique else 1
+        rows = db.select("SELECT INDEX_NAME, GROUP_CONCAT(COLUMN_NAME ORDER BY SEQ_IN_INDEX) "
+                         "FROM information_schema.STATISTICS "
+                         "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = $table AND NON_UNIQUE <= $non_unique "
+                         "GROUP BY INDEX_NAME")
+        return any(index_columns == ','.join(columns) for _, index_columns in rows)
+
+    for index in db.execute(f'PRAGMA index_list("{table}")').fetchall():
+        name, is_unique = index[1], index[2]
+        if (is_unique or not unique) and \
+                [c[2] for c in db.execute(f'PRAGMA index_info("{name}")').fetchall()] == list(columns):
+            return True
+
+    return False
+
+
+def _dedupe_tweet_sauce_cache(table: str) -> int:
+    """
+    Clear out duplicate entries left over from races, keeping the most recent lookup.
+    Duplicates are found through the (tweet_id, index_no) index and deleted a batch at a time, committing after each
+    batch, so row locks are only ever held briefly.
+    Returns:
+        int: The number of rows deleted
+    """
+    q = db.provider.quote_name
+    deleted = 0
+    after = 0
+    while True:
+        groups = db.select(f"SELECT {q('tweet_id')}, {q('index_no')}, MAX({q('id')}) FROM {q(table)} "
+                           f"WHERE {q('tweet_id')} >= $after GROUP BY {q('tweet_id')}, {q('index_no')} "
+                           f"HAVING COUNT(*) > 1 ORDER BY {q('tweet_id')} LIMIT {DEDUPE_BATCH_SIZE}")
+        if not groups:
+            return deleted
+
+        for tweet_id, index_no, keep_id in groups:
+            deleted += db.execute(f"DELETE FROM {q(table)} WHERE {q('tweet_id')} = $tweet_id "
+                                  f"AND {q('index_no')} = $index_no AND {q('id')} < $keep_id").rowcount
+        commit()
+        after = groups[-1][0]
+
+
+def _tweet_sauce_cache_unique_key() -> None:
+    """
+    TweetSauceCache is always looked up by (tweet_id, index_no), but only index_no was indexed
+    """
+    table = TweetSauceCache._table_
+    columns = ['tweet_id', 'index_no']
+    if _index_exists(table, columns, unique=True):
+        return
+
+    quoted_table = db.provider.quote_name(table)
+
+    # On MySQL indexes are built online; reads and writes continue while they're created
+    online = ' ALGORITHM=INPLACE LOCK=NONE' if _is_mysql() else ''
+
+    # A plain index first, so finding duplicates doesn't mean scanning (or locking) the whole table
+    helper_index = not _index_exists(table, columns)
+    if helper_index:
+        db.execute(f"CREATE INDEX idx_tweetsaucecache__tweet_id_index_no ON {quoted_table} (tweet_id, index_no)"
+                   f"{online}")
+
+    for attempt in range(1, UNIQUE_INDEX_ATTEMPTS + 1):
+        deleted = _dedupe_tweet_sauce_cache(table)
+        log.info(f"[SYSTEM] Removed {deleted:,} duplicate sauce cache entries")
+
+        try:
+            db.execute(f"CREATE UNIQUE INDEX unq_tweetsaucecache__tweet_id_index_no ON {quoted_table} "
+                       f"(tweet_id, index_no){online}")
+            break
+        except IntegrityError:
+            # Something wrote a duplicate after we finished cleaning up; clean up again
+            if attempt == UNIQUE_INDEX_ATTEMPTS:
+                raise
+            log.warning("[SYSTEM] New duplicate sauce cache entries appeared while indexing; retrying")
+
+    # The unique index covers every query the plain one did
+    if helper_index:
+        db.execute(f"DROP INDEX idx_tweetsaucecache__tweet_id_index_no"
+                   f"{f' ON {quoted_table}{online}' if _is_mysql() else ''}")
+
+
+def _backfill_sauce_stats() -> None:
+    """
+    Seed the SauceStats rollup from the lookups that were cached or archived before it existed
+    """
+    if SauceStats.select().exists():
+        return
+
+    q = db.provider.quote_name
+    bucket_size = SauceStats.BUCKET_SIZE
+    bucket_sql = f"{q('created_at')} DIV {bucket_size} * {bucket_size}" if _is_mysql() \
+        else f"{q('created_at')} / {bucket_size} * {bucket_size}"
+
+    sources = (
+        (TweetSauceCache._table_, f"CASE WHEN COALESCE({q('sauce_class')}, '') <> '' THEN 1 ELSE 0 END"),
+        (TweetSauceArchive._table_, q('found')),
+    )
+
+    totals = {}
+    for table, found_sql in sources:
+        rows = db.select(f"SELECT {bucket_sql}, COALESCE({q('trigger')}, ''), COALESCE({q('sauce_index')}, ''), "
+                         f"{found_sql}, COUNT(*) FROM {q(table)} GROUP BY 1, 2, 3, 4")
+        for bucket, trigger, sauce_index, found, lookups in rows:
+            found = bool(found)
+            sauce_index = sauce_index if found else ''
+            for key in ((bucket, trigger, sauce_index, found), (SauceStats.ALL_TIME, trigger, sauce_index, found)):
+                totals[key] = totals.get(key, 0) + lookups
+
+    for (bucket, trigger, sauce_index, found), lookups in totals.items():
+        SauceStats(bucket=bucket, trigger=trigger, sauce_index=sauce_index, found=found, lookups=lookups)
+
+
+MIGRATIONS = [
+    Migration(1, 'Add a unique (tweet_id, index_no) index to TweetSauceCache', _tweet_sauce_cache_unique_key),
+    Migration(2, 'Backfill the SauceStats rollup from existing sauce lookups', _backfill_sauce_stats),
+]
+
+
+@db_session
+def applied_versions() -> typing.Set[int]:
+    """
+    Returns:
+        typing.Set[int]: Every migration version that has been applied to this database
+    """
+    return set(select(m.version for m in SchemaMigration))
+
+
+def pending() -> typing.List[Migration]:
+    """
+    Returns:
+        typing.List[Migration]: Migrations that have not been applied yet, in the order they will be applied
+    """
+    applied = applied_versions()
+    return [m for m in sorted(MIGRATIONS, key=lambda m: m.version) if m.version not in applied]
+
+
+def migrate() -> int:
+    """
+    Apply any pending migrations. Each migration runs and is recorded in its own transaction.
+    Returns:
+        int: The number of migrations applied
+    """
+    migrations = pending()
+    for migration in migrations:
+        log.info(f"[SYSTEM] Applying database migration {migration.version}: {migration.name}")
+        started = time.monotonic()
+        with db_session:
+            migration.apply()
+            SchemaMigration(version=migration.version, name=migration.name, applied_at=int(time.time()))
+        log.info(f"[SYSTEM] Migration {migration.version} applied in {time.monotonic() - started:.1f}s")
+
+    return len(migrations)
+
+
+def main(argv: typing.List[str]) -> None:
+    command = argv[0] if argv else 'status'
+    if command == 'migrate':
+        print(f"Applied {migrate()} migration(s)")
+        return
+
+    if command != 'status':
+        print(__doc__.strip())
+        sys.exit(1)
+
+    applied = applied_versions()
+    for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+        state = 'applied' if migration.version in applied else 'pending'
+        print(f"{migration.version:>4}  {state:<8} {migration.name}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
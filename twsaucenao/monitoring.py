@@ -0,0 +1,229 @@
+import logging
+import math
+import time
+import typing
+
+from twsaucenao import ingest
+from twsaucenao.api import async_api
+from twsaucenao.twitter import snowflake_time
+
+# lists/members/create_all and destroy_all accept at most 100 accounts per request
+MEMBERS_CHUNK_SIZE = 100
+
+
+class MonitoredList:
+    def __init__(self, accounts: typing.Iterable[str], name: str, owner, source: ingest.TimelineSource):
+        """
+        Mirrors our monitored accounts into a private Twitter list owned by the bot, so every monitored account can be
+        polled with a single list timeline request instead of one user timeline request per account.
+        Args:
+            accounts (typing.Iterable[str]): Screen names of the monitored accounts
+            name (str): The name of the list to maintain
+            owner: tweepy.models.User for the bot account
+            source (ingest.TimelineSource): Where to stream the list timeline from
+        """
+        self._log = logging.getLogger(__name__)
+        self.name = name
+        self.owner = owner
+        self.source = source
+        self.list_id = None  # type: typing.Optional[int]
+
+        # Tweets are attributed back to accounts as they were written in the configuration file
+        self.accounts = {a.lower(): a for a in accounts}
+
+    async def sync(self) -> int:
+        """
+        Make sure our list exists and its members match the monitored accounts. This only runs once.
+        Returns:
+            int: The list ID
+        """
+        if self.list_id:
+            return self.list_id
+
+        owned = [lst for lst in await async_api.lists_all(user_id=self.owner.id)
+                 if lst.user.id == self.owner.id and lst.name == self.name]
+        if owned:
+            twitter_list = owned[0]
+        else:
+            self._log.info(f"[SYSTEM] Creating private list {self.name} for monitored accounts")
+            twitter_list = await async_api.create_list(self.name, mode='private',
+                                                       description='Accounts monitored for sauce lookups')
+
+        members = {u.screen_name.lower() for u in
+                   await async_api.items('list_members', list_id=twitter_list.id, count=5000)}
+        missing = sorted(set(self.accounts) - members)
+        extra = sorted(members - set(self.accounts))
+
+        for i in range(0, len(missing), MEMBERS_CHUNK_SIZE):
+            await async_api.add_list_members(missing[i:i + MEMBERS_CHUNK_SIZE], twitter_list.id)
+        for i in range(0, len(extra), MEMBERS_CHUNK_SIZE):
+            await async_api.remove_list_members(extra[i:i + MEMBERS_CHUNK_SIZE], twitter_list.id)
+
+        if missing or extra:
+            self._log.info(f"[SYSTEM] Synced list {self.name}: {len(missing)} accounts added, {len(extra)} removed")
+
+        self.list_id = twitter_list.id
+        return self.list_id
+
+    async def timeline(self, since_id: int) -> typing.AsyncIterator[list]:
+        """
+        Stream new tweets from every monitored account, oldest first
+        Args:
+            since_id (int): Only return tweets newer than this ID
+
+        Yields:
+            typing.List[tweepy.models.Status]
+        """
+        list_id = await self.sync()
+        async for tweets in self.source.timeline('list_timeline', list_id=list_id, since_id=since_id,
+                                                 include_rts=True, tweet_mode='extended'):
+            yield tweets
+
+    def account_for(self, tweet) -> typing.Optional[str]:
+        """
+        Returns:
+            typing.Optional[str]: The monitored account a list timeline tweet belongs to
+        """
+        return self.accounts.get(tweet.author.screen_name.lower())
+
+
+class PollScheduler:
+    # Accounts are polled around this many times per post we expect from them
+    POLLS_PER_POST = 4
+
+    # Observed posting rates are blended into the learned rate over roughly this many seconds
+    RATE_HORIZON = 86400.0
+
+    # Rate assumed for an account with no posting history (one post a month)
+    DORMANT_RATE = 1 / (30 * 86400)
+
+    def __init__(self, min_interval: float, max_staleness: float, budget: float):
+        """
+        Decides when each monitored account is next due to be polled.
+        Every account's posting rate is learned from its history, then refined after every poll. Active accounts are
+        polled more often and dormant ones less often, never less often than `max_staleness` and never faster than the
+        request budget allows.
+        Args:
+            min_interval (float): Never poll a single account more often than every `min_interval` seconds
+            max_staleness (float): Always poll every account at least every `max_staleness` seconds
+            budget (float): The maximum number of polls per second, across all accounts
+        """
+        self._log = logging.getLogger(__name__)
+        self.min_interval = min_interval
+        self.max_staleness = max(min_interval, max_staleness)
+        self.budget = budget
+
+        self.rates = {}  # type: typing.Dict[str, float]
+        self.intervals = {}  # type: typing.Dict[str, float]
+        self._last_polled = {}  # type: typing.Dict[str, float]
+        self._over_budget = False
+
+    def learn(self, account: str, tweets: list) -> None:
+        """
+        Estimate an account's posting rate from its recent tweets
+        Args:
+            account (str): The monitored account
+            tweets (list): The accounts most recent tweets (tweepy.models.Status)
+
+        Returns:
+            None
+        """
+        now = time.time()
+        if tweets:
+            oldest = min(snowflake_time(t.id) for t in tweets)
+            self.rates[account] = len(tweets) / max(now - oldest, self.min_interval)
+        else:
+            self.rates[account] = self.DORMANT_RATE
+
+        self._last_polled[account] = now
+        self._reschedule()
+        self._log.info(f"[{account}] Learned posting rate of {self.rates[account] * 86400:.1f}/day; "
+                       f"polling every {self.intervals[account]:.0f} seconds")
+
+    def restore(self, account: str, rate: float) -> None:
+        """
+        Resume with a posting rate we learned previously. The account is polled right away, then scheduled as usual.
+        Args:
+            account (str): The monitored account
+            rate (float): Posts per second
+
+        Returns:
+            None
+        """
+        self.rates[account] = rate
+        self._reschedule()
+
+    def knows(self, account: str) -> bool:
+        """
+        Returns:
+            bool: True if we have a posting rate for this account
+        """
+        return account in self.rates
+
+    def record(self, account: str, new_tweets: int) -> None:
+        """
+        Refine an account's posting rate after polling it
+        Args:
+            account (str): The monitored account
+            new_tweets (int): The number of new tweets the poll returned
+
+        Returns:
+            None
+        """
+        now = time.time()
+        elapsed = max(now - self._last_polled.get(account, now), 1.0)
+        weight = 1 - math.exp(-elapsed / self.RATE_HORIZON)
+        observed = new_tweets / elapsed
+
+        self.rates[account] = (weight * observed) + ((1 - weight) * self.rates.get(account, self.DORMANT_RATE))
+        self._last_polled[account] = now
+        self._reschedule()
+
+    def is_due(self, account: str) -> bool:
+        """
+        Returns:
+            bool: True if the account should be polled now
+        """
+        if account not in self._last_polled:
+            return True
+
+        return time.time() >= self._last_polled[account] + self.intervals[account]
+
+    def wait_time(self) -> float:
+        """
+        Returns:
+            float: Seconds until the next account is due to be polled
+        """
+        if not self._last_polled:
+            return 0.0
+
+        now = time.time()
+        return max(0.0, min(self._last_polled[a] + self.intervals[a] - now for a in self._last_polled))
+
+    def _reschedule(self) -> None:
+        """
+        Assign every account a polling frequency, scaling the busiest accounts back when we'd exceed our budget
+        """
+        floor, ceiling = 1 / self.max_staleness, 1 / self.min_interval
+
+        def frequencies(scale: float) -> typing.Dict[str, float]:
+            return {a: min(ceiling, max(floor, r * self.POLLS_PER_POST * scale)) for a, r in self.rates.items()}
+
+        wanted = frequencies(1.0)
+        if sum(wanted.values()) > self.budget:
+            if floor * len(wanted) > self.budget:
+                # We can't poll everybody within the staleness limit; share the budget evenly instead
+                if not self._over_budget:
+                    self._log.warning(f"[SYSTEM] Polling budget is too small to check {len(wanted)} accounts every "
+                                      f"{self.max_staleness:.0f} seconds")
+                wanted = {a: self.budget / len(wanted) for a in wanted}
+                self._over_budget = True
+            else:
+                low, high = 0.0, 1.0
+                for _ in range(50):
+                    mid = (low + high) / 2
+                    low, high = (mid, high) if sum(frequencies(mid).values()) <= self.budget else (low, mid)
+                wanted = frequencies(low)
+                self._over_budget = False
+
+        self.intervals = {a: 1 / f for a, f in wanted.items()}
@@ -0,0 +1,77 @@
+import io
+import typing
+
+from PIL import Image
+
+# Hashes are split into bands for indexed nearest-neighbour searches. By the pigeonhole principle, two hashes within a
+# Hamming distance of (HASH_BANDS - 1) are guaranteed to share at least one identical band.
+HASH_BITS = 64
+HASH_BANDS = 4
+BAND_BITS = HASH_BITS // HASH_BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+
+
+def dhash(data: bytes, size: int = 8) -> int:
+    """
+    Calculate the difference hash (dHash) of an image.
+    Visually similar images (resized, re-compressed or re-uploaded copies) produce hashes with a small Hamming distance.
+    Args:
+        data (bytes): The raw image file
+        size (int): Hash grid size. The default of 8 produces a 64-bit hash.
+
+    Returns:
+        int
+    """
+    image = Image.open(io.BytesIO(data))
+
+    # We only need a tiny greyscale thumbnail, so let the JPEG decoder skip as much work as it can
+    image.draft('L', (size * 8, size * 8))
+    image = image.convert('L').resize((size + 1, size), Image.BILINEAR)
+    pixels = list(image.getdata())
+
+    media_hash = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            media_hash = (media_hash << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+
+    return media_hash
+
+
+def hamming(hash_a: int, hash_b: int) -> int:
+    """
+    Returns the number of bits that differ between two hashes
+    Args:
+        hash_a (int):
+        hash_b (int):
+
+    Returns:
+        int
+    """
+    return bin(hash_a ^ hash_b).count('1')
+
+
+def bands(media_hash: int) -> typing.Tuple[int, ...]:
+    """
+    Split a hash into its index bands
+    Args:
+        media_hash (int):
+
+    Returns:
+        typing.Tuple[int, ...]
+    """
+    return tuple((media_hash >> (BAND_BITS * i)) & BAND_MASK for i in range(HASH_BANDS))
+
+
+def to_signed(media_hash: int) -> int:
+    """
+    Convert an unsigned 64-bit hash to a signed integer, as neither SQLite nor MySQL support unsigned 64-bit columns
+    """
+    return media_hash - (1 << HASH_BITS) if media_hash >= (1 << (HASH_BITS - 1)) else media_hash
+
+
+def to_unsigned(media_hash: int) -> int:
+    """
+    Convert a signed hash loaded from the database back to its unsigned form
+    """
+    return media_hash + (1 << HASH_BITS) if media_hash < 0 else media_hash
@@ -0,0 +1,115 @@
+import asyncio
+import collections
+import logging
+import typing
+
+
+class LookupQueue:
+    def __init__(self, workers: int = 4):
+        """
+        A shared work queue for sauce lookups, drained by a fixed pool of worker tasks.
+        Jobs submitted under the same conversation key are always processed in the order they were submitted, while
+        jobs for unrelated conversations are processed concurrently. Only the oldest job for each key is ever on the
+        shared queue; the rest wait in a per-key backlog and are queued as their predecessor finishes, so a busy
+        conversation never ties up workers that could be serving other conversations.
+        Args:
+            workers (int): The number of worker tasks to drain the queue with
+        """
+        self._log = logging.getLogger(__name__)
+        self.worker_count = max(1, int(workers))
+
+        # The queue and its workers need a running event loop, so they are only created on first use
+        self._queue = None  # type: typing.Optional[asyncio.Queue]
+        self._workers = []  # type: typing.List[asyncio.Task]
+
+        # Jobs waiting on an earlier job in the same conversation, by conversation key. A key is present for as long
+        # as one of its jobs is queued or running.
+        self._backlog = {}  # type: typing.Dict[typing.Hashable, typing.Deque[tuple]]
+
+    @property
+    def depth(self) -> int:
+        """
+        The number of jobs waiting to be processed, including those waiting on an earlier job in their conversation
+        Returns:
+            int
+        """
+        if not self._queue:
+            return 0
+
+        return self._queue.qsize() + sum(len(jobs) for jobs in self._backlog.values())
+
+    def submit(self, key: typing.Hashable, handler: typing.Callable[..., typing.Awaitable], *args) -> asyncio.Future:
+        """
+        Queue a job for processing
+        Args:
+            key (typing.Hashable): The conversation key. Jobs sharing a key will never run concurrently.
+            handler (typing.Callable[..., typing.Awaitable]): The coroutine function to execute
+            *args: Arguments to pass to the handler
+
+        Returns:
+            asyncio.Future: Resolves with the handlers return value once the job has been processed
+        """
+        self._start()
+
+        future = asyncio.get_event_loop().create_future()
+        job = (key, future, handler, args)
+
+        if key in self._backlog:
+            self._log.debug(f"[SYSTEM] Holding job for conversation {key} until the earlier one finishes")
+            self._backlog[key].append(job)
+        else:
+            self._backlog[key] = collections.deque()
+            self._queue.put_nowait(job)
+
+        return future
+
+    async def close(self) -> None:
+        """
+        Stop our worker tasks. Jobs that are still queued are abandoned.
+        Returns:
+            None
+        """
+        for worker in self._workers:
+            worker.cancel()
+
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers, self._queue = [], None
+        self._backlog.clear()
+
+    def _start(self) -> None:
+        """
+        Spin up our worker tasks
+        Returns:
+            None
+        """
+        if self._queue is not None:
+            return
+
+        self._queue = asyncio.Queue()
+        for _ in range(self.worker_count):
+            self._workers.append(asyncio.ensure_future(self._worker()))
+
+        self._log.info(f"[SYSTEM] Started {self.worker_count} lookup workers")
+
+    # noinspection PyBroadException
+    async def _worker(self) -> None:
+        """
+        Process jobs from the queue until cancelled
+        Returns:
+            None
+        """
+        while True:
+            key, future, handler, args = await self._queue.get()
+            try:
+                future.set_result(await handler(*args))
+            except Exception as error:
+                future.set_exception(error)
+            finally:
+                # Hand the next job in this conversation over to the shared queue
+                backlog = self._backlog.get(key)
+                if backlog:
+                    self._queue.put_nowait(backlog.popleft())
+                else:
+                    self._backlog.pop(key, None)
+
+                self._queue.task_done()
@@ -0,0 +1,329 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import logging
+import time
+import typing
+
+from pysaucenao.containers import SauceNaoResults
+
+from twsaucenao.config import config
+from twsaucenao.models.database import SauceQuota, TRIGGER_MENTION, TRIGGER_MONITORED, TRIGGER_SELF
+
+# SauceNao enforces a short (30 second) and a long (24 hour) request limit on every API key
+SHORT_WINDOW = 30.0
+LONG_WINDOW = 86400.0
+
+# Lookups waiting for a request slot are served in this order
+PRIORITIES = {TRIGGER_MENTION: 0, TRIGGER_SELF: 1, TRIGGER_MONITORED: 2}
+
+# Limits to assume until SauceNao tells us what they actually are
+DEFAULT_SHORT_LIMIT = int(config.get('SauceNao', 'short_limit', fallback=4))
+DEFAULT_LONG_LIMIT = int(config.get('SauceNao', 'long_limit', fallback=100))
+
+
+class TokenBucket:
+    def __init__(self, capacity: int, window: float, tokens: typing.Optional[float] = None,
+                 updated_at: typing.Optional[float] = None):
+        """
+        A request allowance that refills continuously, at `capacity` requests per `window` seconds
+        Args:
+            capacity (int): The maximum number of requests allowed per window
+            window (float): The window length, in seconds
+            tokens (typing.Optional[float]): Requests currently available. Defaults to a full bucket.
+            updated_at (typing.Optional[float]): When `tokens` was last calculated. Defaults to now.
+        """
+        self.capacity = max(1, int(capacity))
+        self.window = window
+        self.tokens = float(self.capacity if tokens is None else tokens)
+        self.updated_at = updated_at or time.time()
+        self._refill()
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / self.window
+
+    def _refill(self) -> None:
+        now = time.time()
+        self.tokens = min(float(self.capacity), self.tokens + max(0.0, now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    @property
+    def available(self) -> float:
+        """
+        Returns:
+            float: The number of requests that can be made right now
+        """
+        self._refill()
+        return self.tokens
+
+    def wait_time(self) -> float:
+        """
+        Returns:
+            float: Seconds until a request can be made
+        """
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self._refill()
+        self.tokens -= 1
+
+    def sync(self, remaining: float, capacity: typing.Optional[int] = None) -> None:
+        """
+        Replace our estimate with the allowance reported by SauceNao
+        Args:
+            remaining (float): Requests remaining in the current window
+            capacity (typing.Optional[int]): The window limit, if known
+
+        Returns:
+            None
+        """
+        if capacity:
+            self.capacity = max(1, int(capacity))
+        self.tokens = min(float(self.capacity), float(remaining))
+        self.updated_at = time.time()
+
+
+class KeyQuota:
+    def __init__(self, key_id: str):
+        """
+        The request allowance of a single SauceNao API key.
+        Kept in sync with every response SauceNao sends back, and persisted so it survives restarts.
+        Args:
+            key_id (str): A stable, non-secret identifier for the API key
+        """
+        self.key_id = key_id
+
+        saved = SauceQuota.fetch(key_id)
+        if saved:
+            self.short = TokenBucket(saved.short_limit, SHORT_WINDOW, saved.short_remaining, saved.updated_at)
+            self.long = TokenBucket(saved.long_limit, LONG_WINDOW, saved.long_remaining, saved.updated_at)
+        else:
+            self.short = TokenBucket(DEFAULT_SHORT_LIMIT, SHORT_WINDOW)
+            self.long = TokenBucket(DEFAULT_LONG_LIMIT, LONG_WINDOW)
+
+        self.in_flight = 0
+        self.requests = 0
+        self.limit_hits = 0
+
+    def wait_time(self) -> float:
+        """
+        Returns:
+            float: Seconds until this key can make another request
+        """
+        return max(self.short.wait_time(), self.long.wait_time())
+
+    def take(self) -> None:
+        self.short.take()
+        self.long.take()
+        self.requests += 1
+
+    def update(self, results: SauceNaoResults) -> None:
+        """
+        Sync our quota with the allowance SauceNao reported in a response
+        Args:
+            results (SauceNaoResults): Any successful SauceNao response
+
+        Returns:
+            None
+        """
+        if results.short_remaining is None or results.long_remaining is None:
+            return
+
+        # Slots we've handed out that SauceNao hasn't counted yet
+        others = max(0, self.in_flight - 1)
+        self.short.sync(int(results.short_remaining) - others, int(results.short_limit or 0))
+        self.long.sync(int(results.long_remaining) - others, int(results.long_limit or 0))
+        self._save()
+
+    def exhausted(self, daily: bool = False) -> None:
+        """
+        Record that SauceNao rejected a request because we ran out of quota
+        Args:
+            daily (bool): True if the long (daily) limit was reached, otherwise the short limit
+
+        Returns:
+            None
+        """
+        (self.long if daily else self.short).sync(0)
+        self.limit_hits += 1
+        self._save()
+
+    def stats(self) -> typing.Dict[str, typing.Union[str, int]]:
+        """
+        Returns:
+            typing.Dict[str, typing.Union[str, int]]: The current quota and usage counters for this key
+        """
+        return {
+            'key_id': self.key_id,
+            'short_remaining': int(self.short.available),
+            'short_limit': self.short.capacity,
+            'long_remaining': int(self.long.available),
+            'long_limit': self.long.capacity,
+            'in_flight': self.in_flight,
+            'requests': self.requests,
+            'limit_hits': self.limit_hits,
+        }
+
+    def _save(self) -> None:
+        SauceQuota.set(self.key_id, self.short.capacity, self.short.available, self.long.capacity,
+                       self.long.available, self.short.updated_at)
+
+
+class Priority:
+    def __init__(self, trigger: str = TRIGGER_MONITORED):
+        """
+        The priority a lookup queues for a request slot at. Lookups shared by several callers are raised to the
+        priority of the most urgent one, even while they're already queued.
+        Args:
+            trigger (str): The event that triggered the lookup
+        """
+        self.value = PRIORITIES.get(trigger, len(PRIORITIES))
+        self._on_raise = None  # type: typing.Optional[typing.Callable[[], None]]
+
+    def raise_to(self, trigger: str) -> None:
+        """
+        Raise the priority to that of another trigger, if it's more urgent
+        Args:
+            trigger (str): The event that triggered the lookup
+
+        Returns:
+            None
+        """
+        value = PRIORITIES.get(trigger, len(PRIORITIES))
+        if value < self.value:
+            self.value = value
+            if self._on_raise:
+                self._on_raise()
+
+
+class QuotaScheduler:
+    def __init__(self, keys: typing.Sequence[KeyQuota]):
+        """
+        Hands out SauceNao request slots across one or more API keys.
+        Lookups queue for a slot by priority (mentions, then self-posts, then monitored accounts) instead of each
+        sleeping and retrying on their own. Each slot goes to the available key with the most daily quota left, so
+        exhausted keys drop out of rotation until they refill.
+        Args:
+            keys (typing.Sequence[KeyQuota]): The quota of every API key in the pool
+        """
+        if not keys:
+            raise ValueError('At least one API key is required')
+
+        self._log = logging.getLogger(__name__)
+        self.keys = list(keys)
+        self._waiters = []  # type: typing.List[typing.List]
+        self._sequence = itertools.count()
+        self._dispatcher = None  # type: typing.Optional[asyncio.Task]
+
+    @property
+    def queued(self) -> int:
+        """
+        Returns:
+            int: The number of lookups waiting for a request slot
+        """
+        return len(self._waiters)
+
+    def wait_time(self) -> float:
+        """
+        Returns:
+            float: Seconds until any key can make another request
+        """
+        return min(key.wait_time() for key in self.keys)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, trigger: str = TRIGGER_MONITORED, priority: typing.Optional[Priority] = None):
+        """
+        Wait for, and hold, a request slot
+        Args:
+            trigger (str): The event that triggered the lookup, which determines its priority
+            priority (typing.Optional[Priority]): A priority to queue at instead, which may be raised while we wait
+
+        Yields:
+            KeyQuota: The API key to make the request with
+        """
+        key = await self.acquire(trigger, priority)
+        key.in_flight += 1
+        try:
+            yield key
+        finally:
+            key.in_flight -= 1
+
+    async def acquire(self, trigger: str = TRIGGER_MONITORED, priority: typing.Optional[Priority] = None) -> KeyQuota:
+        """
+        Wait until a request slot is available, then claim it
+        Args:
+            trigger (str): The event that triggered the lookup, which determines its priority
+            priority (typing.Optional[Priority]): A priority to queue at instead, which may be raised while we wait
+
+        Returns:
+            KeyQuota: The API key the slot was claimed on
+        """
+        if not self._waiters:
+            key = self._available_key()
+            if key:
+                key.take()
+                return key
+
+        priority = priority or Priority(trigger)
+        waiter = asyncio.get_event_loop().create_future()
+        entry = [priority.value, next(self._sequence), waiter]
+        heapq.heappush(self._waiters, entry)
+
+        def reprioritise():
+            entry[0] = priority.value
+            heapq.heapify(self._waiters)
+
+        priority._on_raise = reprioritise
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+        try:
+            return await waiter
+        finally:
+            priority._on_raise = None
+
+    def stats(self) -> typing.List[typing.Dict[str, typing.Union[str, int]]]:
+        """
+        Returns:
+            typing.List[typing.Dict[str, typing.Union[str, int]]]: The current quota and usage of every key
+        """
+        return [key.stats() for key in self.keys]
+
+    def _available_key(self) -> typing.Optional[KeyQuota]:
+        """
+        Returns:
+            typing.Optional[KeyQuota]: The ready key with the most daily quota left, or None if every key is exhausted
+        """
+        ready = [key for key in self.keys if not key.wait_time()]
+        if not ready:
+            return None
+
+        return max(ready, key=lambda k: (k.long.available, k.short.available))
+
+    async def _dispatch(self) -> None:
+        """
+        Release queued lookups, highest priority first, as request slots become available
+        """
+        warned = False
+        while self._waiters:
+            key = self._available_key()
+            if not key:
+                delay = self.wait_time()
+                if delay > SHORT_WINDOW and not warned:
+                    self._log.warning(f"[SYSTEM] SauceNao quota exhausted with {self.queued} lookups queued; "
+                                      f"next request slot in {delay / 60:.0f} minutes")
+                    warned = True
+
+                # Wake up periodically, as a response to a lookup already in flight may correct our estimate
+                await asyncio.sleep(min(delay, SHORT_WINDOW))
+                continue
+
+            _, _, waiter = heapq.heappop(self._waiters)
+            if waiter.done():
+                continue
+
+            key.take()
+            waiter.set_result(key)
@@ -1,74 +1,265 @@
+import asyncio
+import hashlib
 import io
 import logging
+import time
 import typing
 
 import aiohttp
 import twython
 from aiohttp import ClientResponseError
-from pysaucenao import AnimeSource, SauceNao
-from twython import Twython
+from pysaucenao import AnimeSource, DailyLimitReachedException, SauceNao, ShortLimitReachedException
 
+from twsaucenao import phash
+from twsaucenao.api import async_api
+from twsaucenao.cache import LRUCache
 from twsaucenao.config import config
-from twsaucenao.models.database import TRIGGER_SELF, TweetCache, TweetSauceCache
+from twsaucenao.metrics import metrics
+from twsaucenao.models.database import MediaHash, MediaSauceCache, TRIGGER_SELF, TweetCache, TweetSauceCache
+from twsaucenao.quota import KeyQuota, Priority, QuotaScheduler
+from twsaucenao.session import download, http_session
 from twsaucenao.tracemoe import tracemoe
 from twsaucenao.twitter import TweetManager
 
 
+class PooledSauceNao(SauceNao):
+    """
+    pysaucenao opens (and tears down) a brand new HTTP session for every single lookup.
+    This client routes its requests through the application-wide session instead, so connections are reused.
+    """
+    async def _fetch(self, session: aiohttp.ClientSession, url: str, params=None) -> typing.Tuple[int, dict]:
+        async with http_session().get(url, params=params) as response:
+            return response.status, await response.json()
+
+    async def _post(self, session: aiohttp.ClientSession, url: str, params=None) -> typing.Tuple[int, dict]:
+        async with http_session().post(url, data=params) as response:
+            return response.status, await response.json()
+
+
 class SauceManager:
-    def __init__(self, media_tweet: TweetCache, trigger: str = TRIGGER_SELF):
+    def __init__(self):
+        """
+        Long-lived sauce lookup service shared by every trigger.
+        Configuration is parsed and API clients are built once, rather than on every lookup.
+        """
         self._log = logging.getLogger(__name__)
-        self._trigger = trigger
-        self.tweet_cache = media_tweet
-        self.media = TweetManager.extract_media(media_tweet.tweet) or []
         self._downloads_enabled = config.getboolean('SauceNao', 'download_files', fallback=False)
         self._previews_enabled = config.getboolean('TraceMoe', 'enabled', fallback=False)
 
+        # Perceptual hash deduplication of reposted media
+        self._dedupe_enabled = config.getboolean('SauceNao', 'dedupe_enabled', fallback=False)
+        self._dedupe_threshold = int(config.get('SauceNao', 'dedupe_threshold', fallback=3))
+
+        # Results by media URL, in front of the database media cache
+        self._media_cache = LRUCache(int(config.get('SauceNao', 'media_cache_size', fallback=2048)),
+                                     expired=lambda sauce_cache: sauce_cache.created_at < (time.time() - 86400))
+        self._database_hits = 0
+        self._coalesced = 0
+
+        # Lookups currently in progress, so concurrent requests for the same media share a single lookup
+        self._in_flight = {}  # type: typing.Dict[typing.Tuple[int, int], typing.Tuple[asyncio.Future, Priority]]
+
         # SauceNao
         self.minsim_mentioned = float(config.get('SauceNao', 'min_similarity_mentioned', fallback=50.0))
         self.minsim_monitored = float(config.get('SauceNao', 'min_similarity_monitored', fallback=65.0))
         self.minsim_searching = float(config.get('SauceNao', 'min_similarity_searching', fallback=70.0))
         self.persistent = config.getboolean('Twitter', 'enable_persistence', fallback=False)
         self.anime_link = config.get('SauceNao', 'source_link', fallback='anidb').lower()
-        self.sauce = SauceNao(
-                api_key=config.get('SauceNao', 'api_key', fallback=None),
-                min_similarity=min(self.minsim_mentioned, self.minsim_monitored, self.minsim_searching),
-                priority=[21, 22, 5, 37, 25]
-        )
 
-        # Twython
-        self.twython = Twython(config.get('Twitter', 'consumer_key'), config.get('Twitter', 'consumer_secret'),
-                               config.get('Twitter', 'access_token'), config.get('Twitter', 'access_secret'))
+        # One client per API key. Lookups are spread across every key with quota left.
+        api_keys = [k.strip() for k in config.get('SauceNao', 'api_key', fallback='').split(',') if k.strip()] or [None]
+        self._clients = {}  # type: typing.Dict[str, PooledSauceNao]
+        for api_key in api_keys:
+            self._clients[self._key_id(api_key)] = PooledSauceNao(
+                    api_key=api_key,
+                    min_similarity=min(self.minsim_mentioned, self.minsim_monitored, self.minsim_searching),
+                    priority=[21, 22, 5, 37, 25]
+            )
+        self.quota = QuotaScheduler([KeyQuota(key_id) for key_id in self._clients])
 
-        self._sauce_cache = {}
+        metrics.collect('twsaucenao_saucenao_quota_remaining', 'SauceNao requests remaining, by API key and window',
+                        self._quota_remaining)
+        metrics.collect('twsaucenao_media_cache_requests_total', 'Media cache lookups, by result',
+                        lambda: [({'result': k}, v) for k, v in self.cache_stats().items()], kind='counter')
 
-    async def get(self, index: int):
-        try:
-            return self._sauce_cache[index]
-        except KeyError:
-            self._sauce_cache[index] = await self._get_sauce(index)
-            return self._sauce_cache[index]
+    async def get(self, media_tweet: TweetCache, index: int = 0,
+                  trigger: str = TRIGGER_SELF) -> typing.Optional[TweetSauceCache]:
+        """
+        Get the sauce for a media tweet, performing a SauceNao lookup if it has not been cached yet.
+        If a lookup for the same media is already in progress, we wait for its result instead of starting another,
+        raising its queue priority to ours if we're more urgent.
+        Args:
+            media_tweet (TweetCache): The tweet containing media elements
+            index (int): The media indice to look up
+            trigger (str): The event that triggered the sauce lookup
+
+        Returns:
+            typing.Optional[TweetSauceCache]
+        """
+        key = (media_tweet.tweet_id, index)
+        if key in self._in_flight:
+            self._log.debug(f"Waiting on an in-progress lookup for tweet {media_tweet.tweet_id} on indice {index}")
+            self._coalesced += 1
+            lookup, priority = self._in_flight[key]
+            priority.raise_to(trigger)
+        else:
+            priority = Priority(trigger)
+            lookup = asyncio.ensure_future(self._get_sauce(media_tweet, index, trigger, priority))
+            self._in_flight[key] = (lookup, priority)
+            lookup.add_done_callback(lambda _: self._in_flight.pop(key, None))
+
+        # Shielded, so one caller giving up doesn't cancel the lookup for everybody else waiting on it
+        return await asyncio.shield(lookup)
 
-    async def _get_sauce(self, index: int) -> typing.Optional[TweetSauceCache]:
-        cache = TweetSauceCache.fetch(self.tweet_cache.tweet_id, index)
+    def cache_stats(self) -> typing.Dict[str, int]:
+        """
+        Media cache hit / miss counters, and the number of requests that joined a lookup already in progress.
+        Every hit is a SauceNao request we didn't have to make.
+        Returns:
+            typing.Dict[str, int]
+        """
+        return {
+            'memory_hits': self._media_cache.hits,
+            'database_hits': self._database_hits,
+            'misses': self._media_cache.misses - self._database_hits,
+            'coalesced': self._coalesced,
+        }
+
+    def quota_stats(self) -> typing.List[typing.Dict[str, typing.Union[str, int]]]:
+        """
+        Remaining quota and usage counters for each SauceNao API key
+        Returns:
+            typing.List[typing.Dict[str, typing.Union[str, int]]]
+        """
+        return self.quota.stats()
+
+    def _quota_remaining(self) -> typing.Iterator[typing.Tuple[typing.Dict[str, str], int]]:
+        for key in self.quota_stats():
+            yield {'key_id': key['key_id'], 'window': 'short'}, key['short_remaining']
+            yield {'key_id': key['key_id'], 'window': 'long'}, key['long_remaining']
+
+    async def _get_sauce(self, media_tweet: TweetCache, index: int, trigger: str,
+                         priority: Priority) -> typing.Optional[TweetSauceCache]:
+        cache = TweetSauceCache.fetch(media_tweet.tweet_id, index)
+        metrics.cache('tweet_sauce', bool(cache))
         if cache:
             return cache
 
-        media = TweetManager.extract_media(self.tweet_cache.tweet)[index]
+        media = TweetManager.extract_media(media_tweet.tweet)[index]
+        media_url = self._canonical_url(media)
 
-        file = media
-        if self._downloads_enabled:
-            file = await self._download_media(media)
+        # Retweets, quote tweets and replies can all embed the very same upload
+        source = self._cached_media_sauce(media_url)
+        if source:
+            return TweetSauceCache.clone(source, media_tweet, index, trigger, source.media_id)
 
-        if self._downloads_enabled:
-            sauce_results = await self.sauce.from_file(io.BytesIO(file))
-            self._log.info(f"Performing saucenao lookup via file upload")
-        else:
-            self._log.info(f"Performing saucenao lookup via URL {file}")
-            sauce_results = await self.sauce.from_url(file)
+        sauce_cache = await self._fetch_sauce(media_tweet, index, trigger, media, priority)
+        MediaSauceCache.set(media_url, sauce_cache)
+        self._media_cache.set(media_url, sauce_cache)
+
+        return sauce_cache
+
+    def _cached_media_sauce(self, media_url: str) -> typing.Optional[TweetSauceCache]:
+        """
+        Look up a media upload in our in-memory cache first, then fall back to the database
+        Args:
+            media_url (str): The canonical media URL
+
+        Returns:
+            typing.Optional[TweetSauceCache]
+        """
+        sauce_cache = self._media_cache.get(media_url)
+        if sauce_cache:
+            return sauce_cache
+
+        sauce_cache = MediaSauceCache.fetch(media_url)
+        if not sauce_cache:
+            return None
+
+        self._database_hits += 1
+        self._media_cache.set(media_url, sauce_cache)
+        return sauce_cache
+
+    async def _fetch_sauce(self, media_tweet: TweetCache, index: int, trigger: str, media: str,
+                           priority: Priority) -> TweetSauceCache:
+        """
+        Look up media we haven't seen before
+        Args:
+            media_tweet (TweetCache): The tweet containing media elements
+            index (int): The media indice to look up
+            trigger (str): The event that triggered the sauce lookup
+            media (str): The media URL
+            priority (Priority): The priority to queue for a SauceNao request slot at
+
+        Returns:
+            TweetSauceCache
+        """
+        # We need the file itself to upload it to SauceNao or to hash it. Fall back to a URL lookup if this fails.
+        image = None
+        if self._downloads_enabled or self._dedupe_enabled:
+            image = await download(media)
+
+        # Have we already looked up a copy of this image from another tweet?
+        media_hash = None
+        if self._dedupe_enabled and image:
+            media_hash = await self._media_hash(image)
+            duplicate = MediaHash.find_similar(media_hash, self._dedupe_threshold) if media_hash is not None else None
+            source = TweetSauceCache.fetch(duplicate.tweet_id, duplicate.index_no, 0) if duplicate else None
+            if source and source.sauce_class:
+                return TweetSauceCache.clone(source, media_tweet, index, trigger)
+
+        upload = image if self._downloads_enabled else None
+        sauce_cache = await self._lookup(media_tweet, index, trigger, upload or media, priority)
+
+        # Index successful lookups so future reposts can skip SauceNao entirely
+        if media_hash is not None and sauce_cache.sauce_class:
+            MediaHash.set(media_tweet.tweet_id, index, media_hash)
+
+        return sauce_cache
+
+    async def _lookup(self, media_tweet: TweetCache, index: int, trigger: str, file: typing.Union[str, bytes],
+                      priority: Priority) -> TweetSauceCache:
+        """
+        Perform a SauceNao lookup (and a trace.moe video preview lookup, if applicable) and cache the results
+        Args:
+            media_tweet (TweetCache): The tweet containing media elements
+            index (int): The media indice to look up
+            trigger (str): The event that triggered the sauce lookup
+            file (typing.Union[str, bytes]): The media URL, or the downloaded file when uploading files to SauceNao
+            priority (Priority): The priority to queue for a SauceNao request slot at
+
+        Returns:
+            TweetSauceCache
+        """
+        is_upload = isinstance(file, bytes)
+
+        # Queue for a request slot rather than spending requests we know SauceNao will reject
+        while True:
+            async with self.quota.slot(trigger, priority) as key:
+                sauce = self._clients[key.key_id]
+                try:
+                    with metrics.stage('saucenao_lookup'):
+                        if is_upload:
+                            self._log.info(f"Performing saucenao lookup via file upload with key {key.key_id}")
+                            sauce_results = await sauce.from_file(io.BytesIO(file))
+                        else:
+                            self._log.info(f"Performing saucenao lookup via URL {file} with key {key.key_id}")
+                            sauce_results = await sauce.from_url(file)
+                except ShortLimitReachedException:
+                    self._log.warning(f"Short API limit reached on key {key.key_id}, re-queuing lookup")
+                    key.exhausted()
+                    continue
+                except DailyLimitReachedException:
+                    self._log.error(f"Daily API limit reached on key {key.key_id}, re-queuing lookup")
+                    key.exhausted(daily=True)
+                    continue
+
+                key.update(sauce_results)
+                break
 
         # No results?
         if not sauce_results:
-            sauce_cache = TweetSauceCache.set(self.tweet_cache, sauce_results, index, self._trigger)
+            sauce_cache = TweetSauceCache.set(media_tweet, sauce_results, index, trigger)
             return sauce_cache
 
         best_result = sauce_results[0]
@@ -76,9 +267,8 @@ class SauceManager:
         # Attempt to download a video preview, if it's an anime result
         video_preview = None
         if self._previews_enabled and isinstance(best_result, AnimeSource):
-            file = io.BytesIO(file) if self._downloads_enabled else file
-            is_url = not self._downloads_enabled
-            video_preview = await self._video_preview(best_result, file, is_url)
+            file = io.BytesIO(file) if is_upload else file
+            video_preview = await self._video_preview(best_result, file, not is_upload)
 
         # If we have a video preview, upload it now!
         media_id = None
@@ -86,30 +276,37 @@ class SauceManager:
             video_preview = io.BytesIO(video_preview)
             media_id = await self._upload_video(video_preview)
 
-        return TweetSauceCache.set(self.tweet_cache, sauce_results, index, self._trigger, media_id)
+        return TweetSauceCache.set(media_tweet, sauce_results, index, trigger, media_id)
+
+    @staticmethod
+    def _key_id(api_key: typing.Optional[str]) -> str:
+        """
+        A stable identifier for an API key that is safe to store and log
+        """
+        return hashlib.sha256((api_key or '').encode()).hexdigest()[:16]
+
+    @staticmethod
+    def _canonical_url(media_url: str) -> str:
+        """
+        Strip any size / format parameters from a media URL, so every reference to an upload shares one cache key
+        """
+        media_url = media_url.split('?', 1)[0].split('#', 1)[0]
+        return 'https://' + media_url.split('://', 1)[-1]
 
-    async def _download_media(self, media_url: str) -> typing.Optional[bytes]:
+    async def _media_hash(self, image: bytes) -> typing.Optional[int]:
         """
-        Attempt to download an image from twitter and return a BytesIO object
+        Calculate the perceptual hash of an image off the event loop
+        Args:
+            image (bytes): The downloaded image
+
+        Returns:
+            typing.Optional[int]: The hash, or None if the image could not be processed
         """
         try:
-            self._log.debug(f"Downloading image from Twitter: " + media_url)
-            async with aiohttp.ClientSession(raise_for_status=True) as session:
-                try:
-                    async with await session.get(media_url) as response:
-                        image = await response.read()
-                        if not image:
-                            self._log.error(f"Empty file received from Twitter")
-                            return None
-                except aiohttp.ClientResponseError as error:
-                    self._log.warning(f"Twitter returned a {error.status} error when downloading {media_url}")
-                    return None
-
-            return image
-        except aiohttp.ClientTimeout:
-            self._log.warning("Connection timed out while trying to download image from twitter")
-        except aiohttp.ClientError:
-            self._log.exception("An error occurred while trying to download an image from Twitter")
+            return await asyncio.get_event_loop().run_in_executor(None, phash.dhash, image)
+        except Exception:
+            self._log.warning("Unable to calculate a perceptual hash for this image", exc_info=True)
+            return None
 
     async def _video_preview(self, sauce: AnimeSource, path_or_fh: typing.Union[str, typing.BinaryIO],
                              is_url: bool) -> typing.Optional[bytes]:
@@ -117,7 +314,8 @@ class SauceManager:
             return None
 
         try:
-            tracemoe_sauce = await tracemoe.search(path_or_fh, is_url=is_url)
+            with metrics.stage('tracemoe_search'):
+                tracemoe_sauce = await tracemoe.search(path_or_fh, is_url=is_url)
         except ClientResponseError as e:
             if e.status == 503:
                 self._log.warning("Tracemoe is not accepting API queries right now; aborting search query")
@@ -138,7 +336,8 @@ class SauceManager:
                 return None
 
             self._log.info(f'Downloading video preview for AniList entry {sauce.anilist_id} from trace.moe')
-            tracemoe_preview = await tracemoe.video_preview_natural(tracemoe_sauce)
+            with metrics.stage('preview_download'):
+                tracemoe_preview = await tracemoe.video_preview_natural(tracemoe_sauce)
             return tracemoe_preview
 
         return None
@@ -148,7 +347,7 @@ class SauceManager:
         Upload a video to Twitter and return the media ID for embedding
         """
         try:
-            tw_response = self.twython.upload_video(media=media, media_type='video/mp4')
+            tw_response = await async_api.upload_video(media=media, media_type='video/mp4')
             return int(tw_response['media_id'])
         except twython.exceptions.TwythonError as error:
             self._log.error(f"An error occurred while uploading a video preview: {error.msg}")
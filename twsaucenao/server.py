@@ -4,138 +4,132 @@ import reprlib
 import typing
 
 import tweepy
-from pysaucenao import AnimeSource, BooruSource, DailyLimitReachedException, MangaSource, PixivSource, \
+from pysaucenao import AnimeSource, BooruSource, MangaSource, PixivSource, \
     SauceNaoException, \
-    ShortLimitReachedException, \
     VideoSource
-from twython import Twython
 
-from twsaucenao.api import api
+from twsaucenao import ingest
+from twsaucenao.api import api, async_api
+from twsaucenao.cache import ExpiringSet
+from twsaucenao.checkpoint import Checkpoint
 from twsaucenao.config import config
 from twsaucenao.errors import TwSauceNoMediaException
 from twsaucenao.lang import lang
-from twsaucenao.models.database import TRIGGER_MENTION, TRIGGER_MONITORED, TweetCache, TweetSauceCache
+from twsaucenao.maintenance import PROCESSED_POSTS_TTL
+from twsaucenao.metrics import metrics
+from twsaucenao.models.database import ProcessedPost, TRIGGER_MENTION, TRIGGER_MONITORED, TweetCache, \
+    TweetSauceCache
+from twsaucenao.monitoring import MonitoredList, PollScheduler
+from twsaucenao.pipeline import LookupQueue
 from twsaucenao.pixiv import Pixiv
 from twsaucenao.sauce import SauceManager
 from twsaucenao.twitter import ReplyLine, TweetManager
 
 
 class TwitterSauce:
-    def __init__(self):
+    def __init__(self, source: typing.Optional[ingest.TimelineSource] = None):
+        """
+        Args:
+            source (typing.Optional[ingest.TimelineSource]): Where to get new tweets from. Defaults to the Twitter API.
+        """
         self.log = logging.getLogger(__name__)
 
+        # Timelines are streamed from here
+        self.source = source or ingest.default_source()
+
         # Tweet Cache Manager
         self.twitter = TweetManager()
-        self.twython = Twython(config.get('Twitter', 'consumer_key'), config.get('Twitter', 'consumer_secret'),
-                               config.get('Twitter', 'access_token'), config.get('Twitter', 'access_secret'))
 
         self.anime_link = config.get('SauceNao', 'source_link', fallback='anidb').lower()
 
         self.nsfw_previews = config.getboolean('TraceMoe', 'nsfw_previews', fallback=False)
         self.failed_responses = config.getboolean('SauceNao', 'respond_to_failed', fallback=True)
-        self.ignored_indexes = [int(i) for i in config.get('SauceNao', 'ignored_indexes', fallback='').split(',')]
+        self.ignored_indexes = [int(i) for i in config.get('SauceNao', 'ignored_indexes', fallback='').split(',')
+                                if i.strip()]
 
         # Pixiv
         self.pixiv = Pixiv()
 
+        # Sauce lookups
+        self.sauce_manager = SauceManager()
+
         # Cache some information about ourselves
         self.my = api.me()
         self.log.info(f"Connected as: {self.my.screen_name}")
 
-        # A cached list of ID's for parent posts we've already processed
+        # ID's of parent posts we've already processed, restored from the database on startup
         # Used in the check_monitored() method to prevent re-posting sauces when posts are re-tweeted
-        self._posts_processed = []
-
-        # The ID cutoff, we populate this once via an initial query at startup
-        try:
-            self.mention_id = tweepy.Cursor(api.mentions_timeline, tweet_mode='extended', count=1).items(1).next().id
-        except StopIteration:
-            self.mention_id = 0
-
-        try:
-            self.self_id = tweepy.Cursor(api.user_timeline, tweet_mode='extended', count=1).items(1).next().id
-        except StopIteration:
-            self.self_id = 0
+        self._posts_processed = ExpiringSet(int(config.get('Twitter', 'processed_posts_size', fallback=100000)),
+                                            PROCESSED_POSTS_TTL)
+        for tweet_id, processed_at in ProcessedPost.recent(PROCESSED_POSTS_TTL, self._posts_processed.maxsize):
+            self._posts_processed.add(tweet_id, processed_at)
+
+        # Timeline cursors are saved as tweets are processed, so we pick up where we left off after a restart
+        self.mention_cursor = Checkpoint('mentions')
+        self.self_cursor = Checkpoint('self')
+        self.monitored_cursors = {}  # type: typing.Dict[str, Checkpoint]
+
+        # Optionally poll every monitored account at once through a private list
+        self.monitored_list = None
+        if config.getboolean('Twitter', 'monitor_via_list', fallback=False):
+            accounts = [a.strip() for a in str(config.get('Twitter', 'monitored_accounts', fallback='')).split(',')]
+            self.monitored_list = MonitoredList(filter(None, accounts),
+                                                config.get('Twitter', 'monitored_list_name', fallback='sauce-monitored'),
+                                                self.my, self.source)
+            self.monitored_cursors[self.monitored_list.name] = Checkpoint(f"list:{self.monitored_list.name}")
+
+        # Optionally poll each monitored account as often as it actually posts, within a global request budget
+        self.poll_scheduler = None
+        if config.getboolean('Twitter', 'adaptive_polling', fallback=False):
+            self.poll_scheduler = PollScheduler(
+                    min_interval=float(config.get('Twitter', 'monitored_min_interval', fallback=15.0)),
+                    max_staleness=float(config.get('Twitter', 'monitored_max_staleness', fallback=3600.0)),
+                    budget=float(config.get('Twitter', 'monitored_poll_budget', fallback=300)) / 900
+            )
+
+        # Lookups from every trigger are processed through a shared worker pool
+        self.queue = LookupQueue(int(config.get('Twitter', 'lookup_workers', fallback=4)))
+        metrics.collect('twsaucenao_queue_depth', 'Jobs waiting to be processed, by queue',
+                        lambda: [({'queue': 'lookup'}, self.queue.depth),
+                                 ({'queue': 'saucenao_quota'}, self.sauce_manager.quota.queued)])
 
-        self.monitored_since = {}
-
-    # noinspection PyBroadException
     async def check_self(self) -> None:
         """
         Check for new posts from our own account to process
         Returns:
             None
         """
-        self.log.info(f"[{self.my.screen_name}] Retrieving posts since tweet {self.self_id}")
-        posts = [*tweepy.Cursor(api.user_timeline, since_id=self.self_id, tweet_mode='extended').items()]
+        self.log.info(f"[{self.my.screen_name}] Retrieving posts since tweet {self.self_cursor.since_id}")
 
-        # Filter tweets without a reply AND attachment
-        for tweet in posts:
-            try:
-                # Update the ID cutoff before attempting to parse the tweet
-                self.self_id = max([self.self_id, tweet.id])
-                self.log.debug(f"[{self.my.screen_name}] New self-post max ID cutoff: {self.self_id}")
+        # Queue our posts oldest first as they come in, updating the ID cutoff as we go
+        jobs = []
+        async for posts in self.source.timeline('user_timeline', since_id=self.self_cursor.since_id,
+                                                tweet_mode='extended'):
+            await self.twitter.hydrate(posts)
+            for tweet in posts:
+                jobs.append(self._submit(self.self_cursor, tweet, self._process_self, tweet))
+            self.log.debug(f"[{self.my.screen_name}] New self-post max ID cutoff: {self.self_cursor.since_id}")
 
-                # Make sure this isn't a retweet
-                if tweet.full_text.startswith('RT @'):
-                    self.log.debug(f"[{self.my.screen_name}] Skipping a re-tweet")
-                    continue
+        await asyncio.gather(*jobs, return_exceptions=True)
 
-                # Attempt to parse the tweets media content
-                original_cache, media_cache, media = self.get_closest_media(tweet, self.my.screen_name)
-
-                # Get the sauce!
-                sauce_cache = await self.get_sauce(media_cache, log_index=self.my.screen_name)
-                await self.send_reply(tweet_cache=original_cache, media_cache=media_cache, sauce_cache=sauce_cache,
-                                      blocked=media_cache.blocked)
-            except TwSauceNoMediaException:
-                self.log.debug(f"[{self.my.screen_name}] Tweet {tweet.id} has no media to process, ignoring")
-                continue
-            except Exception as e:
-                self.log.exception(f"[{self.my.screen_name}] An unknown error occurred while processing tweet {tweet.id}: {e}")
-                continue
-
-    # noinspection PyBroadException
     async def check_mentions(self) -> None:
         """
         Check for any new mentions we need to parse
         Returns:
             None
         """
-        self.log.info(f"[{self.my.screen_name}] Retrieving mentions since tweet {self.mention_id}")
-        mentions = [*tweepy.Cursor(api.mentions_timeline, since_id=self.mention_id, tweet_mode='extended').items()]
+        self.log.info(f"[{self.my.screen_name}] Retrieving mentions since tweet {self.mention_cursor.since_id}")
 
-        # Filter tweets without a reply AND attachment
-        for tweet in mentions:
-            try:
-                # Update the ID cutoff before attempting to parse the tweet
-                self.mention_id = max([self.mention_id, tweet.id])
-                self.log.debug(f"[{self.my.screen_name}] New max ID cutoff: {self.mention_id}")
+        # Queue our mentions oldest first as they come in, updating the ID cutoff as we go
+        jobs = []
+        async for mentions in self.source.timeline('mentions_timeline', since_id=self.mention_cursor.since_id,
+                                                   tweet_mode='extended'):
+            await self.twitter.hydrate(mentions)
+            for tweet in mentions:
+                jobs.append(self._submit(self.mention_cursor, tweet, self._process_mention, tweet))
+            self.log.debug(f"[{self.my.screen_name}] New max ID cutoff: {self.mention_cursor.since_id}")
 
-                # Make sure we aren't mentioning ourselves
-                if tweet.author.id == self.my.id:
-                    self.log.debug(f"[{self.my.screen_name}] Skipping a self-referencing tweet")
-                    continue
-
-                # Attempt to parse the tweets media content
-                original_cache, media_cache, media = self.get_closest_media(tweet, self.my.screen_name)
-                if media_cache.tweet.author.id == self.my.id:
-                    self.log.info("Not performing a sauce lookup to our own tweet")
-                    continue
-
-                # Did we request a specific index?
-                index = self._determine_requested_index(tweet, media_cache)
-
-                # Get the sauce!
-                sauce_cache = await self.get_sauce(media_cache, index_no=index, log_index=self.my.screen_name)
-                await self.send_reply(tweet_cache=original_cache, media_cache=media_cache, sauce_cache=sauce_cache,
-                                      blocked=media_cache.blocked)
-            except TwSauceNoMediaException:
-                self.log.debug(f"[{self.my.screen_name}] Tweet {tweet.id} has no media to process, ignoring")
-                continue
-            except Exception:
-                self.log.exception(f"[{self.my.screen_name}] An unknown error occurred while processing tweet {tweet.id}")
-                continue
+        await asyncio.gather(*jobs, return_exceptions=True)
 
     async def check_monitored(self) -> None:
         """
@@ -147,60 +141,231 @@ class TwitterSauce:
         if not monitored_accounts:
             return
 
+        if self.monitored_list:
+            return await self._check_monitored_list()
+
         monitored_accounts = [a.strip() for a in monitored_accounts.split(',')]
 
+        jobs = []
         for account in monitored_accounts:
-            # Have we fetched a tweet for this account yet?
-            if account not in self.monitored_since:
-                # If not, get the last tweet ID from this account and wait for the next post
-                tweet = next(tweepy.Cursor(api.user_timeline, account, page=1, tweet_mode='extended').items())
-                self.monitored_since[account] = tweet.id
-                self.log.info(f"[{account}] Monitoring tweets after {tweet.id}")
+            cursor = self._monitored_cursor(account)
+
+            # How often does this account post? If we've never polled it before, its first page tells us.
+            if self.poll_scheduler and not self.poll_scheduler.knows(account):
+                history = await async_api.items('user_timeline', account, limit=20, count=20, tweet_mode='extended')
+                self.poll_scheduler.learn(account, history)
+                cursor.save_rate(self.poll_scheduler.rates[account])
+
+            if self.poll_scheduler and not self.poll_scheduler.is_due(account):
                 continue
 
             # Get all tweets since our last check
-            self.log.info(f"[{account}] Retrieving tweets since {self.monitored_since[account]}")
-            tweets = [*tweepy.Cursor(api.user_timeline, account, since_id=self.monitored_since[account], tweet_mode='extended').items()]
-            self.log.info(f"[{account}] {len(tweets)} tweets found")
+            self.log.info(f"[{account}] Retrieving tweets since {cursor.since_id}")
+            found = 0
+            async for tweets in self.source.timeline('user_timeline', account, since_id=cursor.since_id,
+                                                     tweet_mode='extended'):
+                found += len(tweets)
+                for tweet in tweets:
+                    jobs.append(self._submit(cursor, tweet, self._process_monitored, account, tweet))
+
+            self.log.info(f"[{account}] {found} tweets found")
+            if self.poll_scheduler:
+                self.poll_scheduler.record(account, found)
+                cursor.save_rate(self.poll_scheduler.rates[account])
+
+        await asyncio.gather(*jobs, return_exceptions=True)
+
+    def monitored_wait(self, interval: float) -> float:
+        """
+        How long to wait before checking monitored accounts again
+        Args:
+            interval (float): The configured monitored_interval
+
+        Returns:
+            float: Seconds to wait
+        """
+        if not self.poll_scheduler or self.monitored_list:
+            return interval
+
+        return min(interval, max(1.0, self.poll_scheduler.wait_time()))
+
+    async def _check_monitored_list(self) -> None:
+        """
+        Checks every monitored account for new tweets with a single list timeline query
+        Returns:
+            None
+        """
+        cursor = self.monitored_cursors[self.monitored_list.name]
+        self.log.info(f"[{self.monitored_list.name}] Retrieving tweets since {cursor.since_id}")
+
+        jobs, found = [], 0
+        async for tweets in self.monitored_list.timeline(cursor.since_id):
+            found += len(tweets)
             for tweet in tweets:
-                try:
-                    # Update the ID cutoff before attempting to parse the tweet
-                    self.monitored_since[account] = max([self.monitored_since[account], tweet.id])
+                # Skip anything we can't attribute to a monitored account
+                account = self.monitored_list.account_for(tweet)
+                if not account:
+                    cursor.skip(tweet.id)
+                    continue
 
-                    # Make sure this isn't a comment / reply
-                    if tweet.in_reply_to_status_id:
-                        self.log.info(f"[{account}] Tweet is a reply/comment; ignoring")
-                        continue
+                jobs.append(self._submit(cursor, tweet, self._process_monitored, account, tweet))
 
-                    # Make sure we haven't already processed this post
-                    if tweet.id in self._posts_processed:
-                        self.log.info(f"[{account}] Post has already been processed; ignoring")
-                        continue
-                    self._posts_processed.append(tweet.id)
+        self.log.info(f"[{self.monitored_list.name}] {found} tweets found")
+        await asyncio.gather(*jobs, return_exceptions=True)
 
-                    # Make sure this isn't a re-tweet
-                    if 'RT @' in tweet.full_text or hasattr(tweet, 'retweeted_status'):
-                        self.log.info(f"[{account}] Retweeted post; ignoring")
-                        continue
+    def _monitored_cursor(self, account: str) -> Checkpoint:
+        """
+        Load the polling cursor for a monitored account, restoring its learned posting rate
+        Args:
+            account (str): The monitored account
 
-                    original_cache, media_cache, media = self.get_closest_media(tweet, account)
-                    self.log.info(f"[{account}] Found new media post in tweet {tweet.id}: {media[0]}")
+        Returns:
+            Checkpoint
+        """
+        if account not in self.monitored_cursors:
+            cursor = Checkpoint(f"monitored:{account}")
+            if self.poll_scheduler and cursor.poll_rate:
+                self.poll_scheduler.restore(account, cursor.poll_rate)
+            self.monitored_cursors[account] = cursor
 
-                    # Get the sauce
-                    sauce_cache = await self.get_sauce(media_cache, log_index=account, trigger=TRIGGER_MONITORED)
-                    sauce = sauce_cache.sauce
+        return self.monitored_cursors[account]
 
-                    self.log.info(f"[{account}] Found {sauce.index} sauce for tweet {tweet.id}" if sauce
-                                  else f"[{account}] Failed to find sauce for tweet {tweet.id}")
+    def _submit(self, cursor: Checkpoint, tweet, handler: typing.Callable, *args) -> asyncio.Future:
+        """
+        Queue a tweet for processing, advancing its timeline cursor once it's been handled
+        Args:
+            cursor (Checkpoint): The cursor of the timeline this tweet came from
+            tweet: tweepy.models.Status
+            handler (typing.Callable): The coroutine function to process it with
+            *args: Arguments to pass to the handler
 
-                    await self.send_reply(tweet_cache=original_cache, media_cache=media_cache, sauce_cache=sauce_cache,
-                                          requested=False)
-                except TwSauceNoMediaException:
-                    self.log.info(f"[{account}] No sauce found for tweet {tweet.id}")
-                    continue
-                except Exception as e:
-                    self.log.exception(f"[{account}] An unknown error occurred while processing tweet {tweet.id}: {e}")
-                    continue
+        Returns:
+            asyncio.Future
+        """
+        cursor.track(tweet.id)
+        job = self.queue.submit(self._conversation_key(tweet), handler, *args)
+        job.add_done_callback(lambda _: cursor.done(tweet.id))
+        return job
+
+    # noinspection PyBroadException
+    async def _process_self(self, tweet) -> None:
+        """
+        Process a new post from our own account
+        Args:
+            tweet: tweepy.models.Status
+
+        Returns:
+            None
+        """
+        try:
+            # Make sure this isn't a retweet
+            if tweet.full_text.startswith('RT @'):
+                self.log.debug(f"[{self.my.screen_name}] Skipping a re-tweet")
+                return
+
+            # Attempt to parse the tweets media content
+            original_cache, media_cache, media = await self.get_closest_media(tweet, self.my.screen_name)
+
+            # Get the sauce!
+            sauce_cache = await self.get_sauce(media_cache, log_index=self.my.screen_name)
+            await self.send_reply(tweet_cache=original_cache, media_cache=media_cache, sauce_cache=sauce_cache,
+                                  blocked=media_cache.blocked)
+        except TwSauceNoMediaException:
+            self.log.debug(f"[{self.my.screen_name}] Tweet {tweet.id} has no media to process, ignoring")
+        except Exception as e:
+            self.log.exception(f"[{self.my.screen_name}] An unknown error occurred while processing tweet {tweet.id}: {e}")
+
+    # noinspection PyBroadException
+    async def _process_mention(self, tweet) -> None:
+        """
+        Process a new mention
+        Args:
+            tweet: tweepy.models.Status
+
+        Returns:
+            None
+        """
+        try:
+            # Make sure we aren't mentioning ourselves
+            if tweet.author.id == self.my.id:
+                self.log.debug(f"[{self.my.screen_name}] Skipping a self-referencing tweet")
+                return
+
+            # Attempt to parse the tweets media content
+            original_cache, media_cache, media = await self.get_closest_media(tweet, self.my.screen_name)
+            if media_cache.tweet.author.id == self.my.id:
+                self.log.info("Not performing a sauce lookup to our own tweet")
+                return
+
+            # Did we request a specific index?
+            index = self._determine_requested_index(tweet, media_cache)
+
+            # Get the sauce!
+            sauce_cache = await self.get_sauce(media_cache, index_no=index, log_index=self.my.screen_name)
+            await self.send_reply(tweet_cache=original_cache, media_cache=media_cache, sauce_cache=sauce_cache,
+                                  blocked=media_cache.blocked)
+        except TwSauceNoMediaException:
+            self.log.debug(f"[{self.my.screen_name}] Tweet {tweet.id} has no media to process, ignoring")
+        except Exception:
+            self.log.exception(f"[{self.my.screen_name}] An unknown error occurred while processing tweet {tweet.id}")
+
+    # noinspection PyBroadException
+    async def _process_monitored(self, account: str, tweet) -> None:
+        """
+        Process a new post from a monitored account
+        Args:
+            account (str): The monitored account this tweet was retrieved from
+            tweet: tweepy.models.Status
+
+        Returns:
+            None
+        """
+        try:
+            # Make sure this isn't a comment / reply
+            if tweet.in_reply_to_status_id:
+                self.log.info(f"[{account}] Tweet is a reply/comment; ignoring")
+                return
+
+            # Make sure we haven't already processed this post
+            if tweet.id in self._posts_processed:
+                self.log.info(f"[{account}] Post has already been processed; ignoring")
+                return
+            self._posts_processed.add(tweet.id)
+            ProcessedPost.add(tweet.id)
+
+            # Make sure this isn't a re-tweet
+            if 'RT @' in tweet.full_text or hasattr(tweet, 'retweeted_status'):
+                self.log.info(f"[{account}] Retweeted post; ignoring")
+                return
+
+            original_cache, media_cache, media = await self.get_closest_media(tweet, account)
+            self.log.info(f"[{account}] Found new media post in tweet {tweet.id}: {media[0]}")
+
+            # Get the sauce
+            sauce_cache = await self.get_sauce(media_cache, log_index=account, trigger=TRIGGER_MONITORED)
+            sauce = sauce_cache.sauce
+
+            self.log.info(f"[{account}] Found {sauce.index} sauce for tweet {tweet.id}" if sauce
+                          else f"[{account}] Failed to find sauce for tweet {tweet.id}")
+
+            await self.send_reply(tweet_cache=original_cache, media_cache=media_cache, sauce_cache=sauce_cache,
+                                  requested=False)
+        except TwSauceNoMediaException:
+            self.log.info(f"[{account}] No sauce found for tweet {tweet.id}")
+        except Exception as e:
+            self.log.exception(f"[{account}] An unknown error occurred while processing tweet {tweet.id}: {e}")
+
+    @staticmethod
+    def _conversation_key(tweet) -> int:
+        """
+        Jobs are serialized per conversation, so replies within the same thread are always handled in order
+        Args:
+            tweet: tweepy.models.Status
+
+        Returns:
+            int
+        """
+        return tweet.in_reply_to_status_id or tweet.id
 
     async def get_sauce(self, tweet_cache: TweetCache, index_no: int = 0, log_index: typing.Optional[str] = None,
                         trigger: str = TRIGGER_MENTION) -> TweetSauceCache:
@@ -209,24 +374,15 @@ class TwitterSauce:
         """
         log_index = log_index or 'SYSTEM'
 
-        # Have we cached the sauce already?
+        # Have we cached the sauce already? API limits are handled by the sauce manager, which queues the lookup.
         try:
-            sauce_manager = SauceManager(tweet_cache, trigger)
-            return await sauce_manager.get(index_no)
-        except ShortLimitReachedException:
-            self.log.warning(f"[{log_index}] Short API limit reached, throttling for 30 seconds")
-            await asyncio.sleep(30.0)
-            return await self.get_sauce(tweet_cache, index_no, log_index)
-        except DailyLimitReachedException:
-            self.log.error(f"[{log_index}] Daily API limit reached, throttling for 15 minutes. Please consider upgrading your API key.")
-            await asyncio.sleep(900.0)
-            return await self.get_sauce(tweet_cache, index_no, log_index)
+            return await self.sauce_manager.get(tweet_cache, index_no, trigger)
         except SauceNaoException as e:
             self.log.error(f"[{log_index}] SauceNao exception raised: {e}")
             sauce_cache = TweetSauceCache.set(tweet_cache, index_no=index_no, trigger=trigger)
             return sauce_cache
 
-    def get_closest_media(self, tweet, log_index: typing.Optional[str] = None) -> typing.Optional[typing.Tuple[TweetCache, TweetCache, typing.List[str]]]:
+    async def get_closest_media(self, tweet, log_index: typing.Optional[str] = None) -> typing.Optional[typing.Tuple[TweetCache, TweetCache, typing.List[str]]]:
         """
         Attempt to get the closest media element associated with this tweet and handle any errors if they occur
         Args:
@@ -239,14 +395,14 @@ class TwitterSauce:
         log_index = log_index or 'SYSTEM'
 
         try:
-            original_cache, media_cache, media = self.twitter.get_closest_media(tweet)
+            original_cache, media_cache, media = await self.twitter.get_closest_media(tweet)
         except tweepy.error.TweepError as error:
             # Error 136 means we are blocked
             if error.api_code == 136:
                 # noinspection PyBroadException
                 try:
                     message = lang('Errors', 'blocked', user=tweet.author)
-                    self._post(msg=message, to=tweet.id)
+                    await self._post(msg=message, to=tweet.id)
                 except Exception as error:
                     self.log.exception(f"[{log_index}] An exception occurred while trying to inform a user that an account has blocked us")
                 raise TwSauceNoMediaException
@@ -300,7 +456,7 @@ class TwitterSauce:
                 message = lang('Errors', 'no_results',
                                {'yandex_url': yandex_url, 'ascii_url': ascii_url, 'google_url': google_url},
                                user=tweet.author)
-                self._post(msg=message, to=tweet.id)
+                await self._post(msg=message, to=tweet.id)
             return
 
         # Get the artists Twitter handle if possible
@@ -312,7 +468,7 @@ class TwitterSauce:
         if twitter_sauce and twitter_sauce.lstrip('@').lower() == media_cache.tweet.author.screen_name.lower():
             self.log.info("User requested sauce from a post by the original artist")
             message = lang('Errors', 'sauced_the_artist')
-            self._post(message, to=tweet.id)
+            await self._post(message, to=tweet.id)
             return
 
         # Lines with priority attributes incase we need to shorten them
@@ -440,11 +596,11 @@ class TwitterSauce:
 
         # trace.moe time! Let's get a video preview if we can
         if sauce_cache.media_id:
-            self._post(msg=lines, to=tweet.id, media_ids=[sauce_cache.media_id])
+            await self._post(msg=lines, to=tweet.id, media_ids=[sauce_cache.media_id])
         else:
-            self._post(msg=lines, to=tweet.id)
+            await self._post(msg=lines, to=tweet.id)
 
-    def _post(self, msg: typing.Union[str, typing.List[ReplyLine]], to: typing.Optional[int], media_ids: typing.Optional[typing.List[int]] = None,
+    async def _post(self, msg: typing.Union[str, typing.List[ReplyLine]], to: typing.Optional[int], media_ids: typing.Optional[typing.List[int]] = None,
               sensitive: bool = False):
         """
         Perform a twitter API status update
@@ -471,7 +627,7 @@ class TwitterSauce:
             msg = ''.join(map(str, lines))
 
         try:
-            return api.update_status(msg, **kwargs)
+            return await async_api.update_status(msg, **kwargs)
         except tweepy.error.TweepError as error:
             if error.api_code == 136:
                 self.log.warning("A user requested our presence, then blocked us before we could respond. Wow.")
@@ -486,16 +642,16 @@ class TwitterSauce:
             # Video was too short. Can happen if we're using natural previews. Repost without the video clip
             elif error.api_code == 324:
                 self.log.info(f"Video preview for was too short to upload to Twitter")
-                return self._post(msg=msg, to=to, sensitive=sensitive)
+                return await self._post(msg=msg, to=to, sensitive=sensitive)
             # Something unfamiliar happened, log an error for later review
             elif error.api_code == 186 and lines:
                 self.log.debug("Post is too long; scrubbing message length")
 
-                def _retry(_lines):
+                async def _retry(_lines):
                     _lines = self._shorten_reply(_lines)
                     try:
                         _msg = ''.join(map(str, _lines))
-                        return api.update_status(_msg, **kwargs)
+                        return await async_api.update_status(_msg, **kwargs)
                     except tweepy.TweepError as error:
                         if error.api_code != 186:
                             raise error
@@ -505,7 +661,7 @@ class TwitterSauce:
                 # Shorten the post as much as we can until it fits
                 while True:
                     try:
-                        success = _retry(lines)
+                        success = await _retry(lines)
                     except IndexError:
                         self.log.warning(f"Failed to shorten response message to tweet {to} enough")
                         break
@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import typing
+
+import aiohttp
+
+from twsaucenao.config import config
+
+_log = logging.getLogger(__name__)
+
+# Tuned for many small requests to a handful of hosts (pbs.twimg.com, saucenao.com, trace.moe)
+CONNECT_TIMEOUT = float(config.get('System', 'http_connect_timeout', fallback=5.0))
+READ_TIMEOUT = float(config.get('System', 'http_read_timeout', fallback=30.0))
+CONNECTIONS_PER_HOST = int(config.get('System', 'http_connections_per_host', fallback=8))
+DNS_CACHE_TTL = 300
+KEEPALIVE_TIMEOUT = 30.0
+
+_session = None  # type: typing.Optional[aiohttp.ClientSession]
+
+
+def http_session() -> aiohttp.ClientSession:
+    """
+    Returns the application-wide HTTP session, creating it on first use.
+    All outgoing HTTP requests should be made through this session so connections are pooled and kept alive.
+    This must be called from within a running event loop.
+    Returns:
+        aiohttp.ClientSession
+    """
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit_per_host=CONNECTIONS_PER_HOST, ttl_dns_cache=DNS_CACHE_TTL,
+                                         keepalive_timeout=KEEPALIVE_TIMEOUT)
+        timeout = aiohttp.ClientTimeout(connect=CONNECT_TIMEOUT, sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+        _session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    return _session
+
+
+async def close_session() -> None:
+    """
+    Close the application-wide HTTP session, if it has been opened
+    Returns:
+        None
+    """
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+async def download(url: str) -> typing.Optional[bytes]:
+    """
+    Download a file (e.g. an image from Twitter) and return its contents
+    Args:
+        url (str): The URL to download
+
+    Returns:
+        typing.Optional[bytes]: The file contents, or None if the download failed
+    """
+    try:
+        _log.debug(f"Downloading file: {url}")
+        async with http_session().get(url, raise_for_status=True) as response:
+            data = await response.read()
+            if not data:
+                _log.error(f"Empty file received from {url}")
+                return None
+
+        return data
+    except aiohttp.ClientResponseError as error:
+        _log.warning(f"Server returned a {error.status} error when downloading {url}")
+    except asyncio.TimeoutError:
+        _log.warning(f"Connection timed out while trying to download {url}")
+    except aiohttp.ClientError:
+        _log.exception(f"An error occurred while trying to download {url}")
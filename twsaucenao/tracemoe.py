@@ -9,6 +9,7 @@ from aiohttp import ClientSession
 from PIL import Image
 
 from twsaucenao.config import config
+from twsaucenao.session import http_session
 
 
 class ATraceMoe:
@@ -23,12 +24,13 @@ class ATraceMoe:
         self.main_url = "https://trace.moe/"
         self.media_url = "https://media.trace.moe/"
         self.token = token
-        self.session = ClientSession(
-                headers={
-                    "Content-Type": "application/json"
-                },
-                raise_for_status=True
-        )
+
+    @property
+    def session(self) -> ClientSession:
+        """
+        All requests go through the application-wide HTTP session so connections are pooled and kept alive.
+        """
+        return http_session()
 
     async def me(self):
         """
@@ -42,7 +44,7 @@ class ATraceMoe:
         if self.token:
             url += "?token=%s" % (self.token)
 
-        response = await self.session.get(url)
+        response = await self.session.get(url, raise_for_status=True)
 
         return await response.json()
 
@@ -61,7 +63,7 @@ class ATraceMoe:
             self.main_url, page, response["anilist_id"],
             response["filename"], response["at"], response["tokenthumb"]
         )
-        response = await self.session.get(url)
+        response = await self.session.get(url, raise_for_status=True)
 
         return await response.content.read()
 
@@ -101,7 +103,7 @@ class ATraceMoe:
         if mute:
             url += "&mute"
 
-        response = await self.session.get(url)
+        response = await self.session.get(url, raise_for_status=True)
 
         return await response.content.read()
 
@@ -127,7 +129,7 @@ class ATraceMoe:
             # Discord URL's tend to break with trace.moe at the moment
             if self.DISCORD_IMAGE_URL_RE.match(path):
                 # Load the image
-                response = await self.session.get(path, read_until_eof=False)
+                response = await self.session.get(path, read_until_eof=False, raise_for_status=True)
                 data = io.BytesIO(await response.read())
 
                 # Verify it's a valid image first
@@ -144,24 +146,24 @@ class ATraceMoe:
                 del image
                 encoded = b64encode(data.getvalue()).decode("utf-8")
                 response = await self.session.post(
-                        url, json={"image": encoded, "filter": search_filter}
+                        url, json={"image": encoded, "filter": search_filter}, raise_for_status=True
                 )
             else:
                 response = await self.session.get(
-                    url, params={"url": path}
+                    url, params={"url": path}, raise_for_status=True
                 )
             return loads(await response.text())
         elif isinstance(path, io.BufferedIOBase):
             encoded = b64encode(path.read()).decode("utf-8")
             response = await self.session.post(
-                url, json={"image": encoded, "filter": search_filter}
+                url, json={"image": encoded, "filter": search_filter}, raise_for_status=True
             )
             return loads(await response.text())
         else:
             with open(path, "rb") as f:
                 encoded = b64encode(f.read()).decode("utf-8")
             response = await self.session.post(
-                url, json={"image": encoded, "filter": search_filter}
+                url, json={"image": encoded, "filter": search_filter}, raise_for_status=True
             )
             return loads(await response.text())
 
@@ -1,12 +1,35 @@
 import logging
-from typing import List, Optional, Tuple
+from typing import Iterable, List, Optional, Tuple
 
 import tweepy
 
 from twsaucenao import SAUCENAOPLS_TWITTER_ID
-from twsaucenao.api import api, readonly_api
+from twsaucenao.api import api, async_api, async_readonly_api
 from twsaucenao.errors import TwSauceNoMediaException
-from twsaucenao.models.database import TweetCache, TwitterBlocklist
+from twsaucenao.metrics import metrics
+from twsaucenao.models.database import ResolvedMedia, TweetCache, TwitterBlocklist
+
+# statuses/lookup accepts at most 100 tweet ID's per request
+LOOKUP_CHUNK_SIZE = 100
+
+# Tweet ID's are snowflakes, which embed their creation time in milliseconds since the Twitter epoch
+TWITTER_EPOCH_MS = 1288834974657
+
+
+def snowflake_time(tweet_id: int) -> float:
+    """
+    Returns:
+        float: The UNIX timestamp a tweet was posted at, derived from its ID alone
+    """
+    return ((tweet_id >> 22) + TWITTER_EPOCH_MS) / 1000
+
+
+def snowflake_id(timestamp: float) -> int:
+    """
+    Returns:
+        int: The lowest possible ID of a tweet posted at the given UNIX timestamp, for use as a since_id / max_id
+    """
+    return max(0, int(timestamp * 1000) - TWITTER_EPOCH_MS) << 22
 
 
 class TweetManager:
@@ -17,7 +40,7 @@ class TweetManager:
         self.log = logging.getLogger(__name__)
         self.my = api.me()
 
-    def get_tweet(self, tweet_id: int) -> TweetCache:
+    async def get_tweet(self, tweet_id: int) -> TweetCache:
         """
         Performs a lookup on the given tweet ID.
         Attempts to load the tweet from database cache first, and if that fails, executes a Twitter API query.
@@ -29,20 +52,21 @@ class TweetManager:
         """
         # Attempt to load from cache first
         tweet = TweetCache.fetch(tweet_id)
+        metrics.cache('tweet', bool(tweet))
         if tweet:
             return tweet
 
         # If it's not cached yet, fetch the tweet from the API
         blocked = False
         try:
-            _tweet = api.get_status(tweet_id, tweet_mode='extended')
+            _tweet = await async_api.get_status(tweet_id, tweet_mode='extended')
         except tweepy.TweepError as error:
             # If we're blocked, use readonly parsing if configured, otherwise log an error and re-throw the exception
             if error.api_code == 136:
                 blocked = True
-                if readonly_api:
+                if async_readonly_api:
                     self.log.warning(f"User has blocked the main account; falling back to read-only API for media parsing on tweet {tweet_id}")
-                    _tweet = readonly_api.get_status(tweet_id, tweet_mode='extended')
+                    _tweet = await async_readonly_api.get_status(tweet_id, tweet_mode='extended')
 
                     # Add this account to our blocklist
                     TwitterBlocklist.add(_tweet.author)
@@ -55,7 +79,55 @@ class TweetManager:
         # Cache and return
         return TweetCache.set(_tweet, bool(self.extract_media(_tweet)), blocked=blocked)
 
-    def get_closest_media(self, tweet) -> Tuple[TweetCache, TweetCache, List[str]]:
+    async def hydrate(self, tweets: Iterable) -> int:
+        """
+        Bulk load every parent tweet a batch of tweets will need during traversal into the tweet cache.
+        Reply chains are followed one level at a time across the whole batch, fetching uncached parents with
+        statuses/lookup in chunks of 100 rather than one get_status call per parent. Traversal stops where
+        get_closest_media would stop: at media posts and at our own posts.
+        Anything that couldn't be hydrated is simply looked up individually later.
+        Args:
+            tweets (Iterable): tweepy.models.Status objects about to be processed
+
+        Returns:
+            int: The number of tweets fetched from the API
+        """
+        fetched = 0
+        seen = set()
+        pending = {t.in_reply_to_status_id for t in tweets if t.in_reply_to_status_id}
+
+        while pending:
+            seen |= pending
+            cached = TweetCache.cached_ids(pending)
+            uncached = sorted(pending - cached)
+            metrics.cache('tweet_hydrate', True, len(cached))
+            metrics.cache('tweet_hydrate', False, len(uncached))
+
+            parents = [c.tweet for c in map(TweetCache.fetch, cached) if c]
+            for i in range(0, len(uncached), LOOKUP_CHUNK_SIZE):
+                chunk = uncached[i:i + LOOKUP_CHUNK_SIZE]
+                self.log.info(f"Hydrating {len(chunk)} parent tweets")
+                try:
+                    statuses = await async_api.statuses_lookup(chunk, tweet_mode='extended')
+                except tweepy.TweepError as error:
+                    self.log.warning(f"Unable to hydrate parent tweets: {error.reason}")
+                    return fetched
+
+                for status in statuses:
+                    TweetCache.set(status, bool(self.extract_media(status)))
+                    parents.append(status)
+                fetched += len(statuses)
+
+            # Keep climbing any chains that haven't reached a media post yet. Chains we've already resolved only
+            # need their media tweet.
+            pending = {ResolvedMedia.fetch(p.in_reply_to_status_id) or p.in_reply_to_status_id for p in parents
+                       if p.in_reply_to_status_id and not self.extract_media(p)
+                       and p.author.id not in (self.my.id, SAUCENAOPLS_TWITTER_ID)} - seen
+
+        return fetched
+
+    @metrics.timed('parent_traversal')
+    async def get_closest_media(self, tweet) -> Tuple[TweetCache, TweetCache, List[str]]:
         """
         Find the closet media post associated with this tweet.
         This could be this tweet itself if someone has mentioned us with an upload.
@@ -73,7 +145,7 @@ class TweetManager:
             the second entry is the tweet we pulled media from. Third item is the actual list of media.
         """
         # Check if this is a reply to one of our posts first
-        if self._is_bot_reply(tweet):
+        if await self._is_bot_reply(tweet):
             self.log.info('Skipping a tweet that is a comment on a post by the bot account')
             raise TwSauceNoMediaException
 
@@ -85,9 +157,17 @@ class TweetManager:
             _cache = TweetCache.set(tweet)
 
         # The tweet itself doesn't have any media entities. Time to traverse and look for one
+        traversed = [tweet.id]
         while tweet.in_reply_to_status_id:
+            # Has someone already asked about this thread?
+            media_tweet_id = ResolvedMedia.fetch(tweet.in_reply_to_status_id)
+            if media_tweet_id:
+                cache = await self.get_tweet(media_tweet_id)
+                tweet = cache.tweet
+                break
+
             self.log.info(f'Looking up parent tweet ID ( {tweet.id} => {tweet.in_reply_to_status_id} )')
-            cache = self.get_tweet(tweet.in_reply_to_status_id)
+            cache = await self.get_tweet(tweet.in_reply_to_status_id)
             tweet = cache.tweet
 
             # If this is our own post, that means we've already responded to this thread and need to abort, as all
@@ -102,12 +182,16 @@ class TweetManager:
                 break
 
             # Nothing yet? Continue until we hit the top of the chain
+            traversed.append(tweet.id)
         else:
             raise TwSauceNoMediaException
 
+        # Later replies anywhere in this chain can skip straight to the media tweet
+        ResolvedMedia.set(traversed, cache.tweet_id)
+
         return _cache, cache, self.extract_media(tweet)
 
-    def _is_bot_reply(self, tweet) -> bool:
+    async def _is_bot_reply(self, tweet) -> bool:
         """
         Check and see if this tweet is a reply to a post made by the bots account.
         We can't support queries for the sauce on our own posts, so we just assume we're responsible enough to supply
@@ -119,7 +203,7 @@ class TweetManager:
             bool
         """
         if tweet.in_reply_to_status_id:
-            parent = self.get_tweet(tweet.in_reply_to_status_id)
+            parent = await self.get_tweet(tweet.in_reply_to_status_id)
             if (parent.tweet.author.id == self.my.id) or (parent.tweet.author.id == SAUCENAOPLS_TWITTER_ID):
                 return True
 